@@ -3,83 +3,314 @@ Canteen Rush AI - Multi-Vendor AI Engine
 Enhanced Prediction Engine with Transparency & Adaptive Logic
 """
 
+from collections.abc import Mapping
 from datetime import datetime, timedelta
 import database as db
+import forecast
+import metrics
+import scheduler
 
+# Learned estimates replace the static defaults once they have this many samples
+LEARNED_MIN_SAMPLES = 5
+DEFAULT_SERVICE_MINUTES = 2
 
-def calculate_wait_time(vendor_id: int, item_prep_time: int, target_break: str = "Immediate") -> dict:
+# Rush rule: more than RUSH_THRESHOLD active orders scales queue delay by RUSH_MULTIPLIER
+RUSH_THRESHOLD = 10
+RUSH_MULTIPLIER = 1.5
+BUFFER_MINUTES = 2
+
+# Campus breaks students can pre-order for (the student page's pickup slider)
+BREAKS = ("10:30 AM", "12:00 PM", "1:30 PM", "3:00 PM")
+
+# Predictive rush: orders forecast to arrive within this window count toward RUSH_THRESHOLD
+FORECAST_WINDOW_MIN = 15
+
+# Pre-orders for a break claim capacity in the vendor's pickup slots
+SLOTS = scheduler.SlotScheduler()
+PLACE_RETRIES = 3
+
+
+def _learned_mean(estimates: dict, item_name: str, metric: str):
+    est = estimates.get((item_name, metric))
+    return est["mean"] if est and est["n"] >= LEARNED_MIN_SAMPLES else None
+
+
+def _service_minutes(estimates: dict) -> float:
+    """Minutes each queued order adds: learned vendor service time, else the flat default."""
+    learned = _learned_mean(estimates, "", "service")
+    return learned if learned is not None else DEFAULT_SERVICE_MINUTES
+
+
+def _parse_target_break(target_break: str):
+    """Return (hour, minute) for a break label like "10:30 AM", or None for Immediate/unparseable."""
+    if target_break == "Immediate":
+        return None
+    try:
+        # Extract time from string like "10:30 AM Break"
+        parts = target_break.split(" ")
+        try:
+            target_dt = datetime.strptime(" ".join(parts[:2]), "%I:%M %p")
+        except ValueError:
+            target_dt = datetime.strptime(parts[0], "%I:%M")
+        return target_dt.hour, target_dt.minute
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def _target_time(target, now: datetime):
+    """Today's datetime for a parsed break, or None if there is none or it has passed."""
+    if target is None:
+        return None
+    target_time = now.replace(hour=target[0], minute=target[1], second=0, microsecond=0)
+    return target_time if target_time >= now else None
+
+
+def _forecast_load(vendor_id: int, target, now: datetime) -> float:
+    """Orders forecast to arrive in the FORECAST_WINDOW_MIN before this order is cooked."""
+    target_time = _target_time(target, now)
+    start = now if target_time is None else max(now, target_time - timedelta(minutes=FORECAST_WINDOW_MIN))
+    return forecast.expected_arrivals(vendor_id, start, FORECAST_WINDOW_MIN)
+
+
+def _predict(item_prep_time: int, active_orders_count: int, target, now: datetime,
+             per_order_minutes: float = DEFAULT_SERVICE_MINUTES, slot_fit=None,
+             forecast_load: float = 0.0) -> dict:
     """
-    Calculate wait time for specific vendor with transparency breakdown.
-    
-    Factors:
-    1. Base Prep Time (Deterministic)
-    2. Queue Load (Active orders factor)
-    3. Rush Multiplier (Historical spike emulation)
-    4. Target Break (Scheduling factor)
-    
-    Returns transparency-enabled dict.
+    Build one prediction from already-fetched queue state (no database access).
+    `slot_fit(target_time)` returns (pickup_time, slot) for the earliest
+    pickup slot with spare capacity; it is only consulted for pre-orders.
+    `forecast_load` is the number of orders expected to arrive while this
+    one is being made; it can trigger the rush multiplier before the queue
+    itself has built up.
     """
-    active_orders_count = db.get_vendor_active_orders_count(vendor_id)
-    
-    # 1. Base Prep (Deterministic)
+    # 1. Base Prep (menu seed value or learned prep time)
     base_prep = item_prep_time
     
-    # 2. Queue Delay (2 mins per order ahead)
-    queue_delay = active_orders_count * 2
+    # 2. Queue Delay (learned service time per order ahead, 2 mins by default)
+    queue_delay = active_orders_count * per_order_minutes
     
-    # 3. Rush Detection (>10 orders = Load Spike)
-    is_rush = active_orders_count > 10
-    multiplier = 1.5 if is_rush else 1.0
+    # 3. Rush Detection (>RUSH_THRESHOLD orders now or forecast = Load Spike)
+    is_rush = active_orders_count + forecast_load > RUSH_THRESHOLD
+    multiplier = RUSH_MULTIPLIER if is_rush else 1.0
     
     # Apply multiplier to queue delay
     adjusted_queue_delay = int(queue_delay * multiplier)
     
     # 4. Total Calculation
-    total_wait = base_prep + adjusted_queue_delay + 2 # +2 min buffer
+    total_wait = base_prep + adjusted_queue_delay + BUFFER_MINUTES
     
     # 5. Target Break Handling (Pre-emptive ordering)
-    now = datetime.now()
-    if target_break == "Immediate":
-        pickup_time = now + timedelta(minutes=total_wait)
-    else:
-        # Extract time from string like "10:30 AM Break"
-        try:
-            time_part = target_break.split(" ")[0]
-            target_dt = datetime.strptime(time_part, "%I:%M")
-            # Set to today
-            pickup_time = now.replace(hour=target_dt.hour, minute=target_dt.minute, second=0, microsecond=0)
-            # If target is in past (e.g., today 1 PM but now 2 PM), move to next day or just cap it
-            if pickup_time < now:
-                pickup_time = now + timedelta(minutes=total_wait)
-        except:
-            pickup_time = now + timedelta(minutes=total_wait)
+    pickup_time = now + timedelta(minutes=total_wait)
+    slot = None
+    slot_delay = 0
+    if target is not None:
+        # Set to today; if target is in past (e.g., today 1 PM but now 2 PM), fall back to immediate
+        target_time = _target_time(target, now)
+        if target_time is not None:
+            # Never promise a break earlier than the kitchen could physically finish
+            pickup_time = max(target_time, pickup_time)
+            if slot_fit is not None:
+                fitted, slot = slot_fit(pickup_time)
+                slot_delay = int((fitted - pickup_time).total_seconds() // 60)
+                pickup_time = fitted
 
     formatted_time = pickup_time.strftime("%I:%M %p")
     
     return {
         "formatted_time": formatted_time,
+        "pickup_at": pickup_time,
         "is_rush_hour": is_rush,
         "minutes": total_wait,
         "active_orders": active_orders_count,
+        "forecast_orders": round(forecast_load, 1),
+        "slot": slot,
         "breakdown": {
             "base_prep": base_prep,
             "queue_delay": adjusted_queue_delay,
-            "buffer": 2,
+            "buffer": BUFFER_MINUTES,
+            "slot_delay": slot_delay,
             "total": total_wait
         }
     }
 
 
+def _slot_fit(vendor_id: int, per_order: float, held: dict = None):
+    """slot_fit callable for _predict against the vendor's reserved pickup slots."""
+    capacity = scheduler.slot_capacity(per_order)
+    return lambda when: SLOTS.earliest(vendor_id, when, capacity, held)
+
+
+def calculate_wait_times(vendor_id: int, items, target_break: str = "Immediate") -> list:
+    """
+    Batch version of calculate_wait_time for a whole menu.
+
+    `items` may be menu rows (mappings with `avg_prep_time`) or plain prep times.
+    Menu rows use the item's learned prep time once enough orders have gone
+    Cooking -> Ready. Queue state and estimates are read once and the target
+    break parsed once, so the cost doesn't grow with the number of items.
+    Pre-orders are fitted to the earliest pickup slot with spare capacity
+    (nothing is reserved here). Returns one prediction dict per item, in order.
+    """
+    active_orders_count = db.get_vendor_active_orders_count(vendor_id)
+    estimates = db.get_prep_estimates(vendor_id)
+    per_order = _service_minutes(estimates)
+    target = _parse_target_break(target_break)
+    slot_fit = _slot_fit(vendor_id, per_order) if target is not None else None
+    now = datetime.now()
+    load = _forecast_load(vendor_id, target, now)
+    predictions = []
+    for item in items:
+        prep = item
+        if isinstance(item, Mapping):
+            learned = _learned_mean(estimates, item.get("item_name"), "prep")
+            prep = round(learned) if learned is not None else item["avg_prep_time"]
+        predictions.append(_predict(prep, active_orders_count, target, now, per_order, slot_fit, load))
+    return predictions
+
+
+def calculate_cart_wait_times(cart: list, target_break: str = "Immediate") -> dict:
+    """
+    Predict a whole cart together. `cart` is a list of menu rows (with
+    `vendor_id`, `item_name`, `avg_prep_time`). Queue state is read once per
+    vendor, and each item queues behind the cart items before it at the
+    same vendor. Pre-order items take distinct pickup slots. Returns
+    {"items": [prediction per cart line], "ready_time", "minutes"} where the
+    last two describe when the whole cart is ready.
+    """
+    target = _parse_target_break(target_break)
+    now = datetime.now()
+    vendor_state = {}
+    ahead = {}
+    predictions = []
+    for item in cart:
+        vid = item["vendor_id"]
+        if vid not in vendor_state:
+            estimates = db.get_prep_estimates(vid)
+            per_order = _service_minutes(estimates)
+            held = {}
+            vendor_state[vid] = (db.get_vendor_active_orders_count(vid), estimates, per_order, held,
+                                 _slot_fit(vid, per_order, held) if target is not None else None,
+                                 _forecast_load(vid, target, now))
+        active, estimates, per_order, held, slot_fit, load = vendor_state[vid]
+        learned = _learned_mean(estimates, item.get("item_name"), "prep")
+        prep = round(learned) if learned is not None else item["avg_prep_time"]
+        prediction = _predict(prep, active + ahead.get(vid, 0), target, now, per_order, slot_fit, load)
+        if prediction["slot"] is not None:
+            held[prediction["slot"]] = held.get(prediction["slot"], 0) + 1
+            prediction["capacity"] = scheduler.slot_capacity(per_order)
+        predictions.append(prediction)
+        ahead[vid] = ahead.get(vid, 0) + 1
+    slowest = max(predictions, key=lambda p: p["pickup_at"], default=None)
+    return {
+        "items": predictions,
+        "ready_time": slowest["formatted_time"] if slowest else None,
+        "minutes": slowest["minutes"] if slowest else 0,
+    }
+
+
+def place_cart(user_id: str, cart: list, target_break: str = "Immediate", with_ids: bool = False):
+    """
+    Quote and place a cart, claiming pickup-slot capacity for pre-orders in
+    the same transaction as the orders. If another session filled a slot
+    first, the slot trees are reloaded and the cart re-quoted (up to
+    PLACE_RETRIES times). Returns (tokens, quote), or ((token, order_id)
+    pairs, quote) with `with_ids`.
+    """
+    for attempt in range(PLACE_RETRIES):
+        quote = calculate_cart_wait_times(cart, target_break)
+        lines = [(item["vendor_id"], item["item_name"], p["pickup_at"],
+                  (p["slot"], p["capacity"]) if p["slot"] is not None else None)
+                 for item, p in zip(cart, quote["items"])]
+        try:
+            tokens = db.place_order_batch(user_id, lines, with_ids)
+        except db.SlotFullError:
+            for vid in {item["vendor_id"] for item in cart}:
+                SLOTS.invalidate(vid)
+            if attempt == PLACE_RETRIES - 1:
+                raise
+            continue
+        claimed = {}
+        for vid, _, _, reservation in lines:
+            if reservation is not None:
+                claimed.setdefault((vid, reservation[1]), []).append(reservation[0])
+        for (vid, capacity), slots in claimed.items():
+            SLOTS.commit(vid, slots, capacity)
+        return tokens, quote
+
+
+def calculate_wait_time(vendor_id: int, item_prep_time: int, target_break: str = "Immediate") -> dict:
+    """
+    Calculate wait time for specific vendor with transparency breakdown.
+    
+    Factors:
+    1. Base Prep Time (Deterministic)
+    2. Queue Load (Active orders factor)
+    3. Rush Multiplier (Historical spike emulation)
+    4. Target Break (Scheduling factor)
+    
+    Returns transparency-enabled dict.
+    """
+    return calculate_wait_times(vendor_id, [item_prep_time], target_break)[0]
+
+
 def get_vendor_stats(vendor_id: int) -> dict:
-    """Get queue statistics for specific vendor."""
+    """Get queue statistics for specific vendor, with the demand forecast folded into rush detection."""
     active_orders = db.get_vendor_active_orders_count(vendor_id)
+    per_order = _service_minutes(db.get_prep_estimates(vendor_id))
+    now = datetime.now()
+    upcoming = forecast.expected_arrivals(vendor_id, now, FORECAST_WINDOW_MIN)
     
-    is_rush = active_orders > 10
-    multiplier = 1.5 if is_rush else 1.0
-    avg_wait = int((active_orders * 2 * multiplier) + 5)
+    is_rush = active_orders + upcoming > RUSH_THRESHOLD
+    multiplier = RUSH_MULTIPLIER if is_rush else 1.0
+    avg_wait = int((active_orders * per_order * multiplier) + 5)
     
     return {
         "queue_load": active_orders,
         "avg_wait_minutes": avg_wait,
-        "is_rush_hour": is_rush
+        "is_rush_hour": is_rush,
+        # Rush is coming but the queue hasn't built yet: time to pre-stage
+        "forecast_rush": is_rush and active_orders <= RUSH_THRESHOLD,
+        "forecast_next_window": round(upcoming, 1),
+        "forecast_next_hour": round(forecast.expected_arrivals(vendor_id, now, 60), 1),
     }
+
+
+def get_kds_snapshot(vendor_id: int, now: datetime = None) -> list:
+    """
+    Kitchen display rows for a vendor from a single joined query, earliest
+    start deadline first.
+
+    Each open order gets `prep_time`, `minutes_to_pickup` (None if the order
+    has no pickup deadline), `start_in`, and the `start_now`, `urgent` and
+    `ghost` flags. The clock is read once for the whole snapshot.
+    """
+    return build_kds_snapshot(db.get_kds_orders(vendor_id), now)
+
+
+def build_kds_snapshot(orders: list, now: datetime = None) -> list:
+    """Derive the time-dependent KDS flags for rows from db.get_kds_orders (no database access)."""
+    now = now or datetime.now()
+    now_ts = now.timestamp()
+    snapshot = []
+    for o in orders:
+        # Deadlines are epoch seconds, so they compare across midnight with no parsing
+        wait_rem = (o["pickup_at"] - now_ts) / 60 if o.get("pickup_at") is not None else None
+        start_in = (o["start_by"] - now_ts) / 60 if o.get("start_by") is not None else None
+
+        # Same clock as the no-show sweeper: minutes since Ready, against its threshold
+        ghost = (o["status"] == "Ready" and o.get("ready_at") is not None
+                 and now_ts - o["ready_at"] >= db.NO_SHOW_AFTER_MIN * 60)
+
+        snapshot.append({
+            **o,
+            "minutes_to_pickup": wait_rem,
+            "urgent": wait_rem is not None and 0 < wait_rem < 5,
+            "start_now": start_in is not None and start_in <= 0 and o["status"] == "Received",
+            "start_in": int(max(0, start_in)) if start_in is not None else None,
+            "ghost": ghost,
+        })
+    return snapshot
+
+
+# Every public function above is timed into metrics' "engine" series
+metrics.instrument_module(globals(), "engine")
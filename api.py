@@ -0,0 +1,526 @@
+"""
+Canteen Rush AI - JSON API
+Asyncio HTTP service for kiosks and mobile clients, over database.py and ai_engine.py.
+
+    GET  /health
+    GET  /vendors
+    GET  /vendors/{id}/menu
+    GET  /vendors/{id}/predictions?target=12:30 PM   wait-time prediction per menu item
+    POST /quote                     {"items": [{"vendor_id", "item_id"}, ...], "target_break"}
+    POST /orders                    same body; student auth via X-Roll-No / X-Pin headers
+    GET  /orders/{id}               ?status=Received&wait=25 long-polls until the status moves on
+    GET  /orders/{id}/events        server-sent events, one per status change
+    GET  /me/orders                 the caller's open orders
+
+Every /orders and /me route needs X-Roll-No / X-Pin and only shows the
+caller's own orders: token_id is what the counter checks at pickup.
+
+Blocking database and engine calls run on a thread pool sized to the
+connection pool, so the event loop only parses requests and holds idle
+connections. Status changes are picked up from change_versions, which
+SQLite triggers bump on every order and menu write from any process: one
+watcher per worker polls the versions of every key a client is waiting on
+(plus the catalog) in a single query and wakes those clients. Workers
+share nothing but the database, so several can serve one port:
+
+    python api.py --port 8600 --workers 4
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import signal
+import socket
+import sqlite3
+import traceback
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http import HTTPStatus
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+import ai_engine
+import database as db
+import metrics
+
+HOST = "0.0.0.0"
+PORT = 8600
+THREADS = db.POOL_SIZE          # executor threads for blocking calls (more would just wait on the pool)
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+MAX_CART_ITEMS = 20
+KEEPALIVE_TIMEOUT = 15.0        # seconds an idle connection is kept open
+POLL_INTERVAL = 0.5             # seconds between change-version polls
+POLL_CHUNK = 500                # keys per change-version query
+LONG_POLL_MAX = 30.0            # cap on ?wait=
+SSE_HEARTBEAT = 15.0            # comment line sent on an idle event stream
+SSE_RETRY_MS = 3000             # client reconnect delay
+FINAL_STATUSES = ("Collected", "Expired")
+# token_id is the pickup credential (and the QR payload): only ever sent to the order's owner
+ORDER_FIELDS = ("id", "token_id", "vendor_id", "item_name", "status", "predicted_pickup_time",
+                "pickup_at", "order_time")
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        url = urlsplit(target)
+        self.method, self.path = method, unquote(url.path)
+        self.query = dict(parse_qsl(url.query))
+        self.headers, self.body = headers, body
+        connection = headers.get("connection", "").lower()
+        self.keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+    def json(self):
+        try:
+            payload = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, "body is not valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        return payload
+
+
+def _json_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat(timespec="seconds")
+    if isinstance(obj, Mapping):  # catalog rows are read-only mappings
+        return dict(obj)
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _encode(payload):
+    return json.dumps(payload, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+def _response(status, payload, keep_alive=True, headers=()):
+    body = _encode(payload)
+    head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: keep-alive" if keep_alive else "Connection: close",
+            *headers]
+    return ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+
+
+# ==================== CHANGE WATCHER ====================
+
+def _poll_versions(keys):
+    """Versions for the watched keys plus the catalog keys, in chunked queries (runs on the executor)."""
+    catalog = [("catalog", "all")] + [("vendor", v["id"]) for v in db.get_all_vendors()]
+    keys = catalog + [k for k in keys if k not in catalog]
+    versions = []
+    for i in range(0, len(keys), POLL_CHUNK):
+        versions.extend(db.get_change_versions(*keys[i:i + POLL_CHUNK]))
+    return keys, versions
+
+
+class ChangeWatcher:
+    """
+    Wakes coroutines waiting on change_versions keys, e.g. ("user", roll).
+    Every tick polls all watched keys at once, so the query count doesn't
+    grow with the number of waiting clients. Catalog and vendor bumps also
+    drop this process's catalog snapshots, since the writer may have been
+    another process.
+    """
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self._waiters = {}      # key -> set of asyncio.Event
+        self._versions = {}     # key -> last version seen
+        self.polls = 0
+
+    async def version(self, key):
+        """Current version of `key`; read this before the state it guards, then wait(key, version)."""
+        if key not in self._versions:
+            (self._versions[key],) = await asyncio.to_thread(db.get_change_versions, key)
+        return self._versions[key]
+
+    async def wait(self, key, since, timeout):
+        """True once `key` moves past version `since`, False after `timeout` seconds."""
+        if self._versions.setdefault(key, since) != since:
+            return True
+        event = asyncio.Event()
+        self._waiters.setdefault(key, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters = self._waiters.get(key)
+            if waiters is not None:
+                waiters.discard(event)
+                if not waiters:
+                    del self._waiters[key]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                keys, versions = await asyncio.to_thread(_poll_versions, list(self._waiters))
+            except sqlite3.Error:
+                continue
+            self.polls += 1
+            seen = {}
+            for key, version in zip(keys, versions):
+                seen[key] = version
+                old = self._versions.get(key)
+                if old is None or old == version:
+                    continue
+                if key[0] == "catalog":
+                    db.invalidate_catalog()
+                elif key[0] == "vendor":
+                    # Order writes bump this too; a menu reload per bump is cheap
+                    db.invalidate_catalog(key[1])
+                    db.invalidate_shared_reads(key[1])
+                for event in self._waiters.get(key, ()):
+                    event.set()
+            # Keys nobody waits on any more are forgotten; a new waiter brings its own baseline
+            self._versions = seen
+
+
+WATCHER = ChangeWatcher()
+
+
+# ==================== HANDLERS ====================
+
+ROUTES = []
+
+
+def route(method, pattern, stream=False):
+    """Register a handler. Plain handlers return (status, payload); stream handlers write to the socket themselves."""
+    def register(fn):
+        ROUTES.append((method, re.compile(pattern), fn, stream))
+        return fn
+    return register
+
+
+async def _authenticate(request):
+    roll, pin = request.headers.get("x-roll-no"), request.headers.get("x-pin")
+    if not roll or not pin:
+        raise HTTPError(401, "X-Roll-No and X-Pin headers are required")
+    profile = await asyncio.to_thread(db.authenticate_user, roll, pin)
+    if profile is None:
+        raise HTTPError(401, "invalid roll number or PIN")
+    return profile
+
+
+def _order_view(order):
+    return {k: order[k] for k in ORDER_FIELDS if k in order}
+
+
+def _resolve_cart(lines):
+    """Menu rows for [{"vendor_id", "item_id"}, ...]; every item must be on sale right now."""
+    if not isinstance(lines, list) or not lines:
+        raise HTTPError(400, "items must be a non-empty list")
+    if len(lines) > MAX_CART_ITEMS:
+        raise HTTPError(400, f"at most {MAX_CART_ITEMS} items per order")
+    menus, cart = {}, []
+    for line in lines:
+        try:
+            vendor_id, item_id = int(line["vendor_id"]), int(line["item_id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "each item needs an integer vendor_id and item_id")
+        if vendor_id not in menus:
+            menus[vendor_id] = {m["id"]: m for m in db.get_menu(vendor_id)}
+        item = menus[vendor_id].get(item_id)
+        if item is None:
+            raise HTTPError(404, f"item {item_id} is not available at vendor {vendor_id}")
+        cart.append(item)
+    return cart
+
+
+async def _get_order(order_id, roll_no):
+    """The order, or 404 if it doesn't exist or isn't `roll_no`'s (ids are sequential, so no hint either way)."""
+    order = await asyncio.to_thread(db.get_order, int(order_id))
+    if order is None or order["user_id"] != roll_no:
+        raise HTTPError(404, f"order {order_id} not found")
+    return order
+
+
+@route("GET", r"/health")
+async def health(request):
+    return 200, {"ok": True, "pid": os.getpid(), "polls": WATCHER.polls}
+
+
+@route("GET", r"/vendors")
+async def vendors(request):
+    rows = await asyncio.to_thread(db.get_all_vendors)
+    return 200, [{k: v[k] for k in v.keys() if k != "password"} for v in rows]
+
+
+@route("GET", r"/vendors/(?P<vendor_id>\d+)/menu")
+async def menu(request, vendor_id):
+    return 200, await asyncio.to_thread(db.get_menu, int(vendor_id))
+
+
+@route("GET", r"/vendors/(?P<vendor_id>\d+)/predictions")
+async def predictions(request, vendor_id):
+    target = request.query.get("target", "Immediate")
+    items = await asyncio.to_thread(db.get_menu, int(vendor_id))
+    preds = await asyncio.to_thread(ai_engine.calculate_wait_times, int(vendor_id), items, target)
+    return 200, {"vendor_id": int(vendor_id), "target_break": target,
+                 "items": [{"item_id": item["id"], **p} for item, p in zip(items, preds)]}
+
+
+@route("POST", r"/quote")
+async def quote(request):
+    body = request.json()
+    cart = await asyncio.to_thread(_resolve_cart, body.get("items"))
+    return 200, await asyncio.to_thread(ai_engine.calculate_cart_wait_times, cart,
+                                        str(body.get("target_break", "Immediate")))
+
+
+@route("POST", r"/orders")
+async def place_orders(request):
+    profile = await _authenticate(request)
+    if profile["banned"]:
+        raise HTTPError(403, "account suspended for no-shows")
+    body = request.json()
+    cart = await asyncio.to_thread(_resolve_cart, body.get("items"))
+    try:
+        # Re-quotes and claims pre-order slots in the same transaction as the orders
+        placed, q = await asyncio.to_thread(ai_engine.place_cart, profile["roll_no"], cart,
+                                            str(body.get("target_break", "Immediate")), True)
+    except db.SlotFullError:
+        raise HTTPError(409, "pickup slots just filled up, please try again")
+    placed = await asyncio.to_thread(lambda: [db.get_order(order_id) for _, order_id in placed])
+    return 201, {"orders": [{**_order_view(o), "prediction": p} for o, p in zip(placed, q["items"])],
+                 "ready_time": q["ready_time"], "minutes": q["minutes"]}
+
+
+@route("GET", r"/me/orders")
+async def my_orders(request):
+    profile = await _authenticate(request)
+    rows = await asyncio.to_thread(db.get_user_active_orders, profile["roll_no"])
+    return 200, [_order_view(o) for o in rows]
+
+
+@route("GET", r"/orders/(?P<order_id>\d+)")
+async def order_status(request, order_id):
+    """The caller's order now, or with ?status=S&wait=N once it leaves status S (at most N seconds)."""
+    profile = await _authenticate(request)
+    roll = profile["roll_no"]
+    order = await _get_order(order_id, roll)
+    status = request.query.get("status")
+    try:
+        wait = min(float(request.query.get("wait", 0)), LONG_POLL_MAX)
+    except ValueError:
+        raise HTTPError(400, "wait must be a number of seconds")
+    if status and wait > 0:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        key = ("user", order["user_id"])
+        version = await WATCHER.version(key)
+        order = await _get_order(order_id, roll)
+        while order["status"] == status and deadline > loop.time():
+            await WATCHER.wait(key, version, deadline - loop.time())
+            version = await WATCHER.version(key)
+            order = await _get_order(order_id, roll)
+    return 200, _order_view(order)
+
+
+@route("GET", r"/orders/(?P<order_id>\d+)/events", stream=True)
+async def order_events(request, writer, order_id):
+    """
+    Server-sent events: a `status` event with the order on connect and on
+    every change, until it is Collected or Expired. The event id is the
+    status, so a reconnecting EventSource doesn't replay the current one.
+    Only the order's owner may subscribe.
+    """
+    profile = await _authenticate(request)
+    order = await _get_order(order_id, profile["roll_no"])
+    key = ("user", order["user_id"])
+    writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                  f"Connection: close\r\n\r\nretry: {SSE_RETRY_MS}\n\n").encode("latin-1"))
+    last = request.headers.get("last-event-id")
+    while True:
+        version = await WATCHER.version(key)
+        order = await asyncio.to_thread(db.get_order, int(order_id))
+        if order is None:
+            break
+        if order["status"] != last:
+            last = order["status"]
+            writer.write(f"id: {last}\nevent: status\ndata: {_encode(_order_view(order)).decode()}\n\n".encode("utf-8"))
+        await writer.drain()
+        if last in FINAL_STATUSES:
+            break
+        if not await WATCHER.wait(key, version, SSE_HEARTBEAT):
+            writer.write(b": keep-alive\n\n")
+
+
+# ==================== HTTP SERVER ====================
+
+async def _read_request(reader):
+    """The next request on a connection, or None if the client closed it between requests."""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise HTTPError(400, "incomplete request")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(431, "request headers too large")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(411, "send a Content-Length instead of a chunked body")
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise HTTPError(400, "bad Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return Request(method, target, version, headers, body)
+
+
+async def _dispatch(request, writer):
+    """Run the matching handler and write its response; False when the connection should close."""
+    allowed = []
+    for method, pattern, handler, stream in ROUTES:
+        match = pattern.fullmatch(request.path)
+        if match is None:
+            continue
+        if method != request.method:
+            allowed.append(method)
+            continue
+        try:
+            if stream:
+                await handler(request, writer, **match.groupdict())
+                return False
+            with metrics.timed("api", handler.__name__):
+                status, payload = await handler(request, **match.groupdict())
+        except HTTPError as e:
+            status, payload = e.status, {"error": str(e)}
+        except db.UnknownShardError as e:
+            status, payload = 404, {"error": str(e)}
+        except (ConnectionError, asyncio.CancelledError):
+            raise
+        except Exception:
+            traceback.print_exc()
+            status, payload = 500, {"error": "internal error"}
+        writer.write(_response(status, payload, request.keep_alive))
+        return request.keep_alive
+    if allowed:
+        writer.write(_response(405, {"error": "method not allowed"}, request.keep_alive,
+                               [f"Allow: {', '.join(allowed)}"]))
+    else:
+        writer.write(_response(404, {"error": f"no route for {request.path}"}, request.keep_alive))
+    return request.keep_alive
+
+
+async def _serve_connection(reader, writer):
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(_read_request(reader), KEEPALIVE_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+            except HTTPError as e:
+                writer.write(_response(e.status, {"error": str(e)}, keep_alive=False))
+                await writer.drain()
+                break
+            if request is None or not await _dispatch(request, writer):
+                break
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(sock):
+    """Serve on an already bound, listening socket until SIGINT/SIGTERM."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(THREADS, thread_name_prefix="canteen-api"))
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):  # Windows / not the main thread
+            pass
+    watcher = asyncio.create_task(WATCHER.run())
+    server = await asyncio.start_server(_serve_connection, sock=sock, limit=MAX_HEADER_BYTES)
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        watcher.cancel()
+
+
+def _run_worker(sock, worker, background):
+    if background and worker == 0:
+        db.start_archiver()
+        db.start_sweeper()
+    metrics.start_exporter(path=f"{metrics.EXPORT_PATH}-api-{worker}")
+    try:
+        asyncio.run(serve(sock))
+    finally:
+        db.stop_writer()
+        db.close_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the canteen JSON API.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=1, help="processes sharing the port (needs fork)")
+    parser.add_argument("--db", default=db.DB_FILE)
+    parser.add_argument("--background", action="store_true",
+                        help="also run the archiver and no-show sweeper (skip if the Streamlit app is running)")
+    args = parser.parse_args()
+    db.DB_FILE = args.db
+    db.init_db()
+    # Workers open their own connections and group-commit writers after the fork:
+    # a writer thread started here would not exist in the children
+    db.stop_writer()
+    db.close_pool()
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    print(f"serving on http://{args.host}:{args.port} with {args.workers} worker(s)", flush=True)
+    if args.workers <= 1 or not hasattr(os, "fork"):
+        _run_worker(sock, 0, args.background)
+        return
+    children = []
+    for worker in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _run_worker(sock, worker, args.background)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            os._exit(code)
+        children.append(pid)
+
+    def forward(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    for pid in children:
+        os.waitpid(pid, 0)
+
+
+if __name__ == "__main__":
+    main()
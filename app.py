@@ -5,17 +5,29 @@ Final, Production-Ready Ultimate Edition
 
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
-from datetime import datetime
+from datetime import datetime, timedelta
 import pandas as pd
 import time
 
 import database as db
 import ai_engine
+import forecast
+import images
+import metrics
 
-# Initialize database
-db.init_db()
+@st.cache_resource(show_spinner=False)
+def start_backend():
+    """Migrate, seed and start background workers once per server process (Streamlit re-runs this file on every rerun)."""
+    db.init_db()
+    db.start_archiver()
+    db.start_sweeper()
+    metrics.start_exporter()  # metrics.prom / metrics.json for local scraping
+    # Pull any uncached catalog images onto local disk in the background
+    images.prefetch([v["image_url"] for v in db.get_all_vendors()] +
+                    [m["image_url"] for v in db.get_all_vendors() for m in db.get_menu(v["id"], active_only=False)])
+    return True
 
-# Page configuration
+# Page configuration (older Streamlit releases require it to be the first Streamlit command)
 st.set_page_config(
     page_title="Canteen Rush AI",
     page_icon="🍱",
@@ -23,6 +35,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Initialize database
+start_backend()
+
 # ==================== CONSTANTS & THEME ====================
 THEME_CONFIG = {
     "bg_dark": "#0f172a",
@@ -86,9 +101,20 @@ def init_session_state():
     if "user_info" not in st.session_state: st.session_state.user_info = None
     if "selected_vendor" not in st.session_state: st.session_state.selected_vendor = None
     if "last_statuses" not in st.session_state: st.session_state.last_statuses = {}
+    if "read_cache" not in st.session_state: st.session_state.read_cache = {}
+    if "cart" not in st.session_state: st.session_state.cart = []
 
 init_session_state()
 
+def cached_read(name, version, loader):
+    """Reuse this session's last result of `loader` while `version` is unchanged."""
+    hit = st.session_state.read_cache.get(name)
+    if hit is not None and hit[0] == version:
+        return hit[1]
+    value = loader()
+    st.session_state.read_cache[name] = (version, value)
+    return value
+
 # ==================== AUTHENTICATION ====================
 def render_auth():
     st.markdown('<div class="main-header"><h1>🍱 Canteen Rush AI</h1><p>Production Edition • Multi-Vendor System</p></div>', unsafe_allow_html=True)
@@ -103,15 +129,15 @@ def render_auth():
                 roll = st.text_input("Roll No", placeholder="2024CS001")
                 pin = st.text_input("PIN", type="password", max_chars=4)
                 if st.form_submit_button("Sign In", use_container_width=True):
-                    if db.check_ban_status(roll):
+                    # One query for PIN, name, karma and ban status; later reads hit the profile cache
+                    user = db.authenticate_user(roll, pin)
+                    if user and user["banned"]:
                         st.error("🚫 Account Suspended. Karma < 40.")
-                    else:
-                        user = db.verify_user(roll, pin)
-                        if user:
-                            st.session_state.logged_in, st.session_state.role = True, "student"
-                            st.session_state.user_info = {"roll": roll, "name": user["name"], "points": user["points"]}
-                            st.rerun()
-                        else: st.error("Invalid credentials.")
+                    elif user:
+                        st.session_state.logged_in, st.session_state.role = True, "student"
+                        st.session_state.user_info = {"roll": roll, "name": user["name"], "points": user["points"]}
+                        st.rerun()
+                    else: st.error("Invalid credentials.")
             st.markdown('</div>', unsafe_allow_html=True)
 
     with t2:
@@ -163,7 +189,11 @@ def render_auth():
 
 def render_student():
     st_autorefresh(interval=5000, key="sr")
-    st.session_state.user_info["points"] = db.get_user_points(st.session_state.user_info["roll"])
+    roll = st.session_state.user_info["roll"]
+    sel = st.session_state.selected_vendor
+    # One cheap version check per rerun; cached reads below only hit SQLite when something moved
+    user_v, vendor_v = db.get_change_versions(("user", roll), ("vendor", sel["id"] if sel else 0))
+    st.session_state.user_info["points"] = cached_read("points", user_v, lambda: db.get_user_points(roll, user_v))
     pts = st.session_state.user_info["points"]
 
     c1, c2 = st.columns([3, 1])
@@ -174,7 +204,7 @@ def render_student():
         st.session_state.clear()
         st.rerun()
 
-    active = db.get_user_active_orders(st.session_state.user_info["roll"])
+    active = cached_read("active_orders", user_v, lambda: db.get_user_active_orders(roll))
     if active:
         with st.expander("🕒 Tracking", expanded=True):
             for o in active:
@@ -189,18 +219,18 @@ def render_student():
                 with sc[1]:
                     st.progress(val/100, f"{o['item_name']} ({o['vendor_name']})")
                     if cs == "Ready":
-                        st.markdown('<div class="qr-mock"><img src="https://api.qrserver.com/v1/create-qr-code/?size=100x100&data='+o["token_id"]+'" width="80"></div>', unsafe_allow_html=True)
+                        st.markdown('<div class="qr-mock"><img src="'+images.token_qr_url(o["token_id"])+'" width="80"></div>', unsafe_allow_html=True)
                         st.caption("Show this at counter")
                 
                 sc[2].markdown(f'<span class="badge status-{cs.lower()}">{cs}</span>', unsafe_allow_html=True)
 
     if not st.session_state.selected_vendor:
         st.subheader("🏙️ Select Stall")
-        vs = db.get_all_vendors()
+        vs = db.get_all_vendors()  # shared in-process catalog snapshot
         cols = st.columns(3)
         for i, v in enumerate(vs):
             with cols[i%3]:
-                st.markdown(f'<div class="card-container"><img src="{v["image_url"]}" class="card-image"><h3>{v["name"]}</h3></div>', unsafe_allow_html=True)
+                st.markdown(f'<div class="card-container"><img src="{images.thumbnail_url(v["image_url"], v["name"])}" class="card-image"><h3>{v["name"]}</h3></div>', unsafe_allow_html=True)
                 if st.button(f"Go to {v['name']}", key=f"v_{v['id']}", use_container_width=True):
                     st.session_state.selected_vendor = v
                     st.rerun()
@@ -216,30 +246,61 @@ def render_student():
         with c2:
             target_break = st.select_slider(
                 "🎯 Targeted Pickup / Break",
-                options=["Immediate", "10:30 AM", "12:00 PM", "1:30 PM", "3:00 PM"],
-                value="Immediate"
+                options=["Immediate", *ai_engine.BREAKS],
+                value="Immediate",
+                key="target_break"
             )
         
         items = db.get_menu(v["id"])
+        # Predictions also move with the clock, so they are keyed on the current minute too
+        predictions = cached_read(f"predictions_{v['id']}", (vendor_v, target_break, datetime.now().strftime("%H:%M")),
+                                  lambda: ai_engine.calculate_wait_times(v["id"], items, target_break))
         icols = st.columns(3)
-        for i, item in enumerate(items):
+        for i, (item, p) in enumerate(zip(items, predictions)):
             with icols[i%3]:
-                p = ai_engine.calculate_wait_time(v["id"], item["avg_prep_time"], target_break)
                 st.markdown(f"""
                 <div class="card-container">
-                    <img src="{item["image_url"]}" class="card-image">
+                    <img src="{images.thumbnail_url(item["image_url"], item["item_name"])}" class="card-image">
                     <h4>{item["item_name"]}</h4>
                     <p style="color:{THEME_CONFIG["accent_green"]}; font-size:1.2rem; font-weight:bold;">₹{item["price"]}</p>
-                    <p class="tooltip" title="Prep: {p['breakdown']['base_prep']}m | Queue: {p['breakdown']['queue_delay']}m | Buffer: {p['breakdown']['buffer']}m">
+                    <p class="tooltip" title="Prep: {p['breakdown']['base_prep']}m | Queue: {p['breakdown']['queue_delay']}m | Buffer: {p['breakdown']['buffer']}m | Slot wait: {p['breakdown']['slot_delay']}m">
                         ⏱️ Predicted: {p['minutes']} mins
                     </p>
                 </div>
                 """, unsafe_allow_html=True)
                 
-                if st.button(f"Order {item['item_name']}", key=f"oi_{item['id']}", use_container_width=True):
-                    tid = db.add_order(st.session_state.user_info["roll"], v["id"], item["item_name"], p["formatted_time"])
-                    st.success(f"Token: {tid} | Pickup: {p['formatted_time']}")
-                    st.balloons()
+                if st.button(f"🛒 Add {item['item_name']}", key=f"oi_{item['id']}", use_container_width=True):
+                    st.session_state.cart.append({**item, "vendor_name": v["name"]})
+                    st.rerun()
+
+    render_cart()
+
+def render_cart():
+    cart = st.session_state.cart
+    if not cart:
+        return
+    target_break = st.session_state.get("target_break", "Immediate")
+    quote = ai_engine.calculate_cart_wait_times(cart, target_break)
+    with st.expander(f"🛒 Cart ({len(cart)})", expanded=True):
+        for i, (item, p) in enumerate(zip(cart, quote["items"])):
+            cc = st.columns([3, 2, 1, 1])
+            cc[0].write(f"{item['item_name']} • {item['vendor_name']}")
+            cc[1].write(f"⏱️ {p['formatted_time']} ({p['minutes']}m)")
+            cc[2].write(f"₹{item['price']}")
+            if cc[3].button("✖", key=f"rm_{i}"):
+                cart.pop(i)
+                st.rerun()
+        st.markdown(f"**Total: ₹{sum(i['price'] for i in cart)} • All ready by {quote['ready_time']}**")
+        if st.button("✅ Checkout", use_container_width=True):
+            try:
+                # Re-quotes and claims pre-order slots in the same transaction as the orders
+                tokens, quote = ai_engine.place_cart(st.session_state.user_info["roll"], cart, target_break)
+            except db.SlotFullError:
+                st.error("Pickup slots just filled up. Please try again.")
+                return
+            st.session_state.cart = []
+            st.success(f"Tokens: {', '.join(tokens)} | Pickup by {quote['ready_time']}")
+            st.balloons()
 
 def render_vendor():
     st_autorefresh(interval=10000, key="vr")
@@ -250,11 +311,16 @@ def render_vendor():
         st.session_state.clear()
         st.rerun()
 
-    s = ai_engine.get_vendor_stats(v_id)
+    (vendor_v,) = db.get_change_versions(("vendor", v_id))
+    # Stats include the demand forecast, which moves with the clock
+    s = cached_read("vendor_stats", (vendor_v, datetime.now().strftime("%H:%M")), lambda: ai_engine.get_vendor_stats(v_id))
     mc = st.columns(3)
     mc[0].metric("Queue", s["queue_load"])
     mc[1].metric("Wait", f"{s['avg_wait_minutes']}m")
     mc[2].metric("Rush", "🔥" if s["is_rush_hour"] else "✅")
+    if s["forecast_rush"]:
+        st.warning(f"📈 Rush forecast: ~{s['forecast_next_window']:.0f} orders in the next {ai_engine.FORECAST_WINDOW_MIN} min. Pre-stage prep now.")
+    render_forecast_panel(v_id, s)
 
     with st.sidebar:
         st.header("⚙️ Supply")
@@ -263,36 +329,34 @@ def render_vendor():
                 db.toggle_item_availability(item["id"], not (item["is_active"]==1))
                 st.rerun()
 
-    orders = db.get_vendor_orders(v_id)
+    # Counter handoff: scan or type a token instead of scrolling the queue
+    tok = st.text_input("🔎 Scan / Enter Token", placeholder="#VR-042", key="token_lookup")
+    if tok:
+        found = db.lookup_by_token(v_id, tok)
+        if not found:
+            st.warning(f"No order {tok} today or still open.")
+        else:
+            tc = st.columns([1, 3, 1])
+            tc[0].write(found["token_id"])
+            tc[1].write(f"👤 {found['student_name']} • {found['item_name']} ({found['predicted_pickup_time']})")
+            tc[2].markdown(f'<span class="badge status-{found["status"].lower()}">{found["status"]}</span>', unsafe_allow_html=True)
+            if found["status"] == "Ready" and st.button("🛡️ Verify & Collect", key="token_collect"):
+                db.update_status(found["id"], "Collected")
+                st.rerun()
+
+    orders = ai_engine.build_kds_snapshot(cached_read("kds_orders", vendor_v, lambda: db.get_kds_orders(v_id)))
     for o in orders:
-        urgent, ghost = False, False
-        try:
-            pt = datetime.strptime(o['predicted_pickup_time'], "%I:%M %p")
-            nt = datetime.strptime(datetime.now().strftime("%I:%M %p"), "%I:%M %p")
-            df = (pt - nt).total_seconds() / 60
-            if 0 < df < 5: urgent = True
-            
-            ot = datetime.strptime(o['order_time'], "%Y-%m-%d %H:%M:%S")
-            if o['status'] == "Ready" and (datetime.now() - ot).total_seconds() / 60 > 20: ghost = True
-        except: pass
-        
-        style = "urgent-row" if urgent else ("karma-badge karma-yellow" if ghost else "")
+        style = "urgent-row" if o["urgent"] else ("karma-badge karma-yellow" if o["ghost"] else "")
         st.markdown(f'<div class="vendor-order-row {style}">', unsafe_allow_html=True)
         oc = st.columns([1, 1.5, 2, 2.5])
         oc[0].write(o["token_id"])
         
         # Proactive Prep Logic
-        try:
-            pt = datetime.strptime(o['predicted_pickup_time'], "%I:%M %p")
-            nt = datetime.strptime(datetime.now().strftime("%I:%M %p"), "%I:%M %p")
-            # If wait matches prep_time, highlight start
-            prep_needed = db.get_item_prep_time_by_name(o['item_name'])
-            wait_rem = (pt - nt).total_seconds() / 60
-            if wait_rem <= prep_needed + 2 and o["status"] == "Received":
-                oc[1].warning(f"⏰ Start NOW!")
-            else:
-                oc[1].write(f"In {int(max(0, wait_rem - prep_needed))}m")
-        except:
+        if o["start_now"]:
+            oc[1].warning(f"⏰ Start NOW!")
+        elif o["start_in"] is not None:
+            oc[1].write(f"In {o['start_in']}m")
+        else:
             oc[1].write(o["item_name"])
             
         oc[2].write(f"👤 {o['student_name']} ({o['predicted_pickup_time']})")
@@ -310,29 +374,109 @@ def render_vendor():
                 st.rerun()
         st.markdown("</div>", unsafe_allow_html=True)
 
+def render_forecast_panel(v_id, stats):
+    with st.expander(f"📈 Demand Forecast • ~{stats['forecast_next_hour']:.0f} orders next hour"):
+        f = forecast.forecast(v_id)
+        if not f["orders"].any():
+            st.caption("Not enough order history yet.")
+            return
+        df = pd.DataFrame({"time": [t.strftime("%H:%M") for t in f["times"]], "expected orders": f["orders"]})
+        st.bar_chart(df.set_index("time"))
+        peak = int(f["orders"].argmax())
+        st.caption(f"Peak {f['times'][peak].strftime('%I:%M %p')} (~{f['orders'][peak]:.1f} orders per "
+                   f"{f['bucket_minutes']} min), from this weekday's history.")
+
 def render_admin():
     st.title("🛡️ System Master View")
     if st.button("Safe Logout"): 
         st.session_state.clear()
         st.rerun()
     
-    st.subheader("👥 Global Userbase & Karma")
-    with db.get_db() as conn:
-        users = pd.read_sql("SELECT roll_no, name, points FROM users", conn)
-        st.dataframe(users, use_container_width=True)
-    
-    st.subheader("📊 Global Order Log")
-    with db.get_db() as conn:
-        orders = pd.read_sql("SELECT * FROM orders ORDER BY order_time DESC LIMIT 50", conn)
-        st.dataframe(orders, use_container_width=True)
+    t1, t2, t3, t4 = st.tabs(["📈 Dashboard", "👥 Userbase & Karma", "📊 Order Log", "⚡ Performance"])
+
+    with t1:
+        window = st.radio("Window", ["Today", "Last 7 days"], horizontal=True)
+        since = datetime.now() - timedelta(days=0 if window == "Today" else 7)
+        since_hour = since.strftime("%Y-%m-%d 00:00")
+        totals = pd.DataFrame(db.get_vendor_rollup_totals(since_hour))
+        mc = st.columns(3)
+        mc[0].metric("Orders", int(totals["orders"].sum()) if not totals.empty else 0)
+        mc[1].metric("No-Shows", int(totals["no_shows"].sum()) if not totals.empty else 0)
+        waits = totals["avg_wait"].dropna() if not totals.empty else []
+        mc[2].metric("Avg Wait", f"{waits.mean():.1f}m" if len(waits) else "—")
+        st.dataframe(totals.drop(columns=["vendor_id"]) if not totals.empty else totals, use_container_width=True)
+        hourly = pd.DataFrame(db.get_hourly_rollup(since_hour))
+        if not hourly.empty:
+            st.bar_chart(hourly.pivot_table(index="hour", columns="vendor_name", values="orders", aggfunc="sum").fillna(0))
+
+    with t2:
+        render_keyset_page("users", lambda cursor: db.get_users_page(cursor, ADMIN_PAGE_SIZE), "roll_no")
+
+    with t3:
+        render_keyset_page("orders", lambda cursor: db.get_orders_page(cursor, ADMIN_PAGE_SIZE), "id")
+
+    with t4:
+        render_performance()
+
+def render_performance():
+    snap = metrics.snapshot()
+    st.caption(f"Rolling {snap['window_seconds'] // 60}-minute window for this server process • "
+               f"percentiles are histogram bucket bounds • exported to {metrics.EXPORT_PATH}.prom/.json")
+
+    def table(kind, top=15):
+        rows = []
+        for name, s in snap["series"].get(kind, {}).items():
+            w = s["window"]
+            if w["count"]:
+                rows.append({"name": name, "calls": w["count"], "mean ms": round(w["mean_ms"], 2),
+                             "p50 ms": w["p50_ms"], "p95 ms": w["p95_ms"], "p99 ms": w["p99_ms"],
+                             "total ms": round(w["mean_ms"] * w["count"], 1),
+                             **({"rows": s["rows"], "vm steps": s["vm_steps"]} if kind == "query" else {})})
+        df = pd.DataFrame(rows)
+        return df.sort_values("total ms", ascending=False).head(top) if not df.empty else df
+
+    st.subheader("Page renders")
+    st.dataframe(table("render"), use_container_width=True, hide_index=True)
+    st.subheader("Helpers by total time")
+    st.dataframe(pd.concat([table("db"), table("engine")]).sort_values("total ms", ascending=False).head(20)
+                 if snap["series"].get("db") or snap["series"].get("engine") else pd.DataFrame(),
+                 use_container_width=True, hide_index=True)
+    st.subheader("SQL by total time")
+    st.dataframe(table("query"), use_container_width=True, hide_index=True)
+    st.subheader(f"Slow statements (≥ {metrics.SLOW_QUERY_MS} ms)")
+    slow = pd.DataFrame(reversed(snap["slow_queries"]))
+    if not slow.empty:
+        slow["at"] = pd.to_datetime(slow["at"], unit="s")
+    st.dataframe(slow, use_container_width=True, hide_index=True)
+    st.caption(f"Caches: profiles {db.get_profile_cache_stats()} • catalog {db.get_catalog_cache_stats()}")
+    st.caption(f"Shared per-vendor reads (fan-in = calls per query run): {db.get_read_coalescing_stats()}")
+    if st.button("Export metrics now"):
+        metrics.write_files()
+
+ADMIN_PAGE_SIZE = 50
+
+def render_keyset_page(name, fetch, key_col):
+    """Render one page of `fetch(cursor)` with First/Next controls; cursors live in session state."""
+    stack = st.session_state.setdefault(f"{name}_cursors", [None])
+    rows = fetch(stack[-1])
+    st.dataframe(pd.DataFrame(rows), use_container_width=True)
+    pc = st.columns([1, 1, 4])
+    pc[2].caption(f"Page {len(stack)}")
+    if pc[0].button("⏮ First", key=f"{name}_first", disabled=len(stack) == 1):
+        st.session_state[f"{name}_cursors"] = [None]
+        st.rerun()
+    if pc[1].button("Next ▶", key=f"{name}_next", disabled=len(rows) < ADMIN_PAGE_SIZE):
+        stack.append(rows[-1][key_col])
+        st.rerun()
 
 # ==================== MAIN ====================
 def main():
     try:
-        if not st.session_state.logged_in: render_auth()
-        elif st.session_state.role == "student": render_student()
-        elif st.session_state.role == "vendor": render_vendor()
-        elif st.session_state.role == "admin": render_admin()
+        page = "auth" if not st.session_state.logged_in else st.session_state.role
+        render = {"auth": render_auth, "student": render_student, "vendor": render_vendor, "admin": render_admin}.get(page)
+        if render:
+            with metrics.timed("render", page):
+                render()
     except Exception as e:
         st.error(f"🔥 Core Error: {str(e)}")
         if st.button("Hard Reset"): st.session_state.clear(); st.rerun()
@@ -0,0 +1 @@
+"""Standalone benchmarks for the Canteen Rush AI data layer. Run from the repo root."""
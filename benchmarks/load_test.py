@@ -0,0 +1,260 @@
+"""
+Concurrent load test for database.py / ai_engine.py.
+
+Replays a weighted mix of the app's hot calls from N worker threads against
+a throwaway database and reports per-operation p50/p95/p99 latency,
+throughput and `database is locked` error rates. Results are written as JSON
+so runs can be diffed for regressions:
+
+    python -m benchmarks.load_test --preset campus --threads 16 --duration 30 --out run.json
+    python -m benchmarks.load_test --preset campus --threads 16 --compare run.json
+    python -m benchmarks.load_test --sharded --mix '{"add_order": 1, "update_status": 1}'
+    python -m benchmarks.load_test --threads 64 --max-staleness 0 --mix '{"calculate_wait_time": 1}'
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import ai_engine
+import database as db
+
+PRESETS = {
+    # users, historical (finished) orders, live orders per vendor
+    "small": {"users": 200, "history": 2_000, "live": 10},
+    "campus": {"users": 20_000, "history": 500_000, "live": 40},
+}
+
+# Relative frequency of each call during a lunch rush
+DEFAULT_MIX = {
+    "get_user_active_orders": 30,
+    "calculate_wait_time": 25,
+    "get_vendor_orders": 15,
+    "add_order": 12,
+    "update_status": 12,
+    "verify_user": 6,
+}
+
+NEXT_STATUS = ["Cooking", "Ready", "Collected"]
+
+
+def seed(preset, rng):
+    cfg = PRESETS[preset]
+    with db.get_db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (roll_no, name, pin) VALUES (?, ?, '0000')",
+                         ((f"U{i}", f"Student {i}") for i in range(cfg["users"])))
+        menu = [(r["vendor_id"], r["item_name"]) for r in conn.execute("SELECT vendor_id, item_name FROM menu")]
+        rows = ((f"#VR-{i}", f"U{rng.randrange(cfg['users'])}", *rng.choice(menu),
+                 rng.choice(("Collected", "Collected", "Collected", "Expired")), "12:00 PM")
+                for i in range(cfg["history"]))
+        conn.executemany("""INSERT INTO orders (token_id, user_id, vendor_id, item_name, status, predicted_pickup_time)
+                            VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        vendors = sorted({v for v, _ in menu})
+        live = ((f"#VR-L{i}", f"U{rng.randrange(cfg['users'])}", v, rng.choice([n for vid, n in menu if vid == v]),
+                 rng.choice(("Received", "Cooking", "Ready")), "12:00 PM")
+                for v in vendors for i in range(cfg["live"]))
+        conn.executemany("""INSERT INTO orders (token_id, user_id, vendor_id, item_name, status, predicted_pickup_time)
+                            VALUES (?, ?, ?, ?, ?, ?)""", live)
+        conn.commit()
+    return cfg["users"], menu
+
+
+class Workload:
+    """Shared state for worker threads: the catalog and a rough high-water order id per file."""
+
+    def __init__(self, users, menu):
+        self.users = users
+        self.menu = menu
+        self.vendors = sorted({v for v, _ in menu})
+        # Each shard has its own id range, so keep one high-water mark per shard (one in total unsharded)
+        self._high = {}
+        for shard in self.vendors if db.SHARDED else [None]:
+            with db.get_db(shard) as conn:
+                self._high[shard] = conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+        self._added = itertools.count(1)
+        self.added = 0
+
+    def op(self, name, rng):
+        user = f"U{rng.randrange(self.users)}"
+        if name == "add_order":
+            vendor_id, item = rng.choice(self.menu)
+            db.add_order(user, vendor_id, item, "12:00 PM")
+            self.added = next(self._added)
+            self._high[vendor_id if db.SHARDED else None] += 1
+        elif name == "update_status":
+            shard = rng.choice(list(self._high))
+            hi = self._high[shard]
+            lo = shard * db.ORDER_ID_STRIDE + 1 if shard is not None else 1
+            db.update_status(rng.randint(max(lo, hi - 500), hi), rng.choice(NEXT_STATUS))
+        elif name == "get_user_active_orders":
+            db.get_user_active_orders(user)
+        elif name == "get_vendor_orders":
+            db.get_vendor_orders(rng.choice(self.vendors))
+        elif name == "calculate_wait_time":
+            ai_engine.calculate_wait_time(rng.choice(self.vendors), rng.randint(3, 15))
+        elif name == "verify_user":
+            db.verify_user(user, "0000")
+        else:
+            raise ValueError(f"unknown operation {name!r}")
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def run(preset="small", threads=8, duration=10.0, mix=None, pool_size=None, seed_value=1, write_behind=False,
+        sharded=False, max_staleness=None):
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed_value)
+    workdir = tempfile.mkdtemp(prefix="canteen-load-")
+    db.DB_FILE = os.path.join(workdir, "load.db")
+    if pool_size:
+        db.POOL_SIZE = pool_size
+    db.close_pool()
+    db.WRITE_BEHIND = write_behind
+    db.SHARDED = False
+    if max_staleness is not None:
+        db.COALESCE_MAX_STALENESS = max_staleness
+    db.init_db()
+    users, menu = seed(preset, rng)
+    if sharded:
+        # Shards are created (and take over the seeded orders) on the second init
+        db.SHARDED = True
+        db.init_db()
+    workload = Workload(users, menu)
+
+    names, weights = list(mix), list(mix.values())
+    samples = {n: [] for n in names}
+    errors = {n: {"locked": 0, "other": 0} for n in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(i):
+        wrng = random.Random(seed_value * 1000 + i)
+        local = {n: [] for n in names}
+        local_err = {n: {"locked": 0, "other": 0} for n in names}
+        while time.perf_counter() < deadline:
+            name = wrng.choices(names, weights)[0]
+            start = time.perf_counter()
+            try:
+                workload.op(name, wrng)
+                local[name].append(time.perf_counter() - start)
+            except sqlite3.OperationalError as e:
+                local_err[name]["locked" if "locked" in str(e) else "other"] += 1
+            except Exception:
+                local_err[name]["other"] += 1
+        with lock:
+            for n in names:
+                samples[n].extend(local[n])
+                errors[n]["locked"] += local_err[n]["locked"]
+                errors[n]["other"] += local_err[n]["other"]
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+    write_metrics = db.get_write_metrics() if write_behind else None
+    coalescing = db.get_read_coalescing_stats()
+
+    ops = {}
+    total_ok = total_locked = total_err = 0
+    for n in names:
+        lat = sorted(samples[n])
+        ok, locked, other = len(lat), errors[n]["locked"], errors[n]["other"]
+        total_ok, total_locked, total_err = total_ok + ok, total_locked + locked, total_err + other
+        ops[n] = {
+            "count": ok,
+            "locked_errors": locked,
+            "other_errors": other,
+            "mean_ms": sum(lat) / ok * 1000 if ok else None,
+            "p50_ms": _percentile(lat, 50) * 1000 if ok else None,
+            "p95_ms": _percentile(lat, 95) * 1000 if ok else None,
+            "p99_ms": _percentile(lat, 99) * 1000 if ok else None,
+        }
+    attempts = total_ok + total_locked + total_err
+    result = {
+        "config": {"preset": preset, "threads": threads, "duration_s": duration, "mix": mix,
+                   "pool_size": db.POOL_SIZE, "write_behind": write_behind, "sharded": sharded,
+                   "max_staleness_s": db.COALESCE_MAX_STALENESS, "seed": seed_value,
+                   "sqlite": sqlite3.sqlite_version},
+        "throughput_ops_s": total_ok / elapsed,
+        "locked_rate": total_locked / attempts if attempts else 0.0,
+        "error_rate": total_err / attempts if attempts else 0.0,
+        "ops": ops,
+        "group_commit": write_metrics,
+        "coalescing": coalescing,
+    }
+    db.stop_writer()
+    db.close_pool()
+    db.SHARDED = False
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+    return result
+
+
+def print_result(result, baseline=None):
+    cfg = result["config"]
+    print(f"preset={cfg['preset']} threads={cfg['threads']} duration={cfg['duration_s']}s pool={cfg['pool_size']}"
+          + (" sharded" if cfg.get("sharded") else ""))
+    if result.get("group_commit"):
+        gc = result["group_commit"]
+        print(f"group commit: {gc['ops']} ops in {gc['batches']} batches (avg {gc['avg_batch']:.1f}, max {gc['max_batch']}), "
+              f"max queue depth {gc['max_queue_depth']}")
+    if result.get("coalescing", {}).get("loads"):
+        co = result["coalescing"]
+        print(f"read coalescing: {co['calls']} calls ran {co['loads']} queries (fan-in {co['fan_in']}), "
+              f"{co['joined']} joined in flight, {co['reused']} reused")
+    print(f"throughput {result['throughput_ops_s']:.0f} ops/s | locked {result['locked_rate']:.2%} | other errors {result['error_rate']:.2%}")
+    print(f"{'operation':<26}{'count':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'locked':>8}" + ("   p95 vs baseline" if baseline else ""))
+    for name, o in result["ops"].items():
+        fmt = lambda v: f"{v:>9.2f}" if v is not None else f"{'-':>9}"
+        line = f"{name:<26}{o['count']:>9}{fmt(o['p50_ms'])}{fmt(o['p95_ms'])}{fmt(o['p99_ms'])}{o['locked_errors']:>8}"
+        base = (baseline or {}).get("ops", {}).get(name)
+        if base and base.get("p95_ms") and o["p95_ms"]:
+            line += f"   {(o['p95_ms'] / base['p95_ms'] - 1):+.0%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="small")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--pool-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--write-behind", action="store_true", help="route writes through the group-commit writer")
+    parser.add_argument("--sharded", action="store_true", help="one database file per vendor (db.SHARDED)")
+    parser.add_argument("--max-staleness", type=float, default=None,
+                        help="seconds shared per-vendor reads may be reused (db.COALESCE_MAX_STALENESS; 0 = in-flight only)")
+    parser.add_argument("--mix", type=json.loads, default=None, help='JSON weights, e.g. \'{"add_order": 1}\'')
+    parser.add_argument("--out", help="write the result JSON here")
+    parser.add_argument("--compare", help="baseline result JSON to compare p95 latency against")
+    args = parser.parse_args()
+
+    result = run(args.preset, args.threads, args.duration, args.mix, args.pool_size, args.seed, args.write_behind,
+                 args.sharded, args.max_staleness)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_result(result, baseline)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Hot-path query scaling benchmark.
+
+Seeds a throwaway database with N historical orders (almost all Collected /
+Expired, plus a fixed handful of live ones, like a real canteen) and times the
+vendor/user active-order queries. With the migration indexes the timings stay
+flat as N grows; run with --no-indexes to see the full-scan baseline (every
+secondary index on orders dropped, plus idx_menu_item_name). Shared reads are
+not coalesced here, so each call runs its query. get_vendor_active_orders_count
+reads the trigger-maintained queue counters and stays flat either way.
+
+    python -m benchmarks.query_scaling --sizes 1000 10000 100000 1000000
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import database as db
+
+LIVE_ORDERS_PER_VENDOR = 15
+VENDORS = (1, 2, 3)
+USERS = 500
+
+
+def seed(n_orders, rng):
+    with db.get_db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO users (roll_no, name, pin) VALUES (?, ?, '0000')",
+                         ((f"U{i}", f"Student {i}") for i in range(USERS)))
+        history = n_orders - LIVE_ORDERS_PER_VENDOR * len(VENDORS)
+        rows = ((f"#VR-{i}", f"U{rng.randrange(USERS)}", rng.choice(VENDORS), "Classic Burger",
+                 rng.choice(("Collected", "Collected", "Collected", "Expired")), "12:00 PM")
+                for i in range(max(0, history)))
+        conn.executemany("""INSERT INTO orders (token_id, user_id, vendor_id, item_name, status, predicted_pickup_time)
+                            VALUES (?, ?, ?, ?, ?, ?)""", rows)
+        live = ((f"#VR-L{v}{i}", f"U{rng.randrange(USERS)}", v, "Classic Burger",
+                 rng.choice(("Received", "Cooking", "Ready")), "12:00 PM")
+                for v in VENDORS for i in range(LIVE_ORDERS_PER_VENDOR))
+        conn.executemany("""INSERT INTO orders (token_id, user_id, vendor_id, item_name, status, predicted_pickup_time)
+                            VALUES (?, ?, ?, ?, ?, ?)""", live)
+        conn.commit()
+
+
+def time_call(fn, *args, repeat=200):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(*args)
+    return (time.perf_counter() - start) / repeat * 1e6  # microseconds per call
+
+
+def run(size, indexes=True, seed_value=7):
+    rng = random.Random(seed_value)
+    workdir = tempfile.mkdtemp(prefix="canteen-bench-")
+    db.DB_FILE = os.path.join(workdir, "bench.db")
+    db.COALESCE_MAX_STALENESS = 0  # time the queries, not the read coalescer
+    db.init_db()
+    dropped = []
+    if not indexes:
+        with db.get_db() as conn:
+            dropped = [r[0] for r in conn.execute("""SELECT name FROM sqlite_master
+                                                     WHERE type = 'index' AND sql IS NOT NULL
+                                                       AND (tbl_name = 'orders' OR name = 'idx_menu_item_name')""")]
+            for name in dropped:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+            conn.commit()
+    seed(size, rng)
+    with db.get_db() as conn:
+        conn.execute("ANALYZE")
+        conn.commit()
+    result = {
+        "orders": size,
+        "dropped_indexes": dropped,
+        "get_vendor_orders": time_call(db.get_vendor_orders, 1),
+        "get_user_active_orders": time_call(db.get_user_active_orders, "U1"),
+        "get_vendor_active_orders_count": time_call(db.get_vendor_active_orders_count, 1),
+        "get_item_prep_time_by_name": time_call(db.get_item_prep_time_by_name, "Cold Brew"),
+    }
+    db.close_pool()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--no-indexes", action="store_true", help="drop every secondary index on orders (baseline)")
+    args = parser.parse_args()
+
+    cols = ["get_vendor_orders", "get_user_active_orders", "get_vendor_active_orders_count", "get_item_prep_time_by_name"]
+    print(f"{'orders':>10} " + " ".join(f"{c:>32}" for c in cols) + "   (µs/call)")
+    for i, size in enumerate(args.sizes):
+        r = run(size, indexes=not args.no_indexes)
+        if i == 0 and r["dropped_indexes"]:
+            print(f"dropped: {', '.join(r['dropped_indexes'])}")
+        print(f"{r['orders']:>10} " + " ".join(f"{r[c]:>32.1f}" for c in cols))
+
+
+if __name__ == "__main__":
+    main()
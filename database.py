@@ -4,100 +4,892 @@ Production-Ready Database Layer (REFACTORED)
 """
 
 import sqlite3
-import random
-from contextlib import contextmanager
-from datetime import datetime
+import threading
+import queue
+import time
+import atexit
+import json
+import os
+from concurrent.futures import Future
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from functools import partial
+from datetime import datetime, timedelta
+from types import MappingProxyType
+
+import metrics
 
 DB_FILE = "canteen.db"
+MIN_SQLITE_VERSION = (3, 35, 0)  # UPDATE ... RETURNING (3.35), UPDATE ... FROM (3.33), upserts (3.24)
 
-@contextmanager
-def get_db():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DB_FILE)
+# --- CONNECTION POOL SETTINGS ---
+POOL_SIZE = 8                # max connections checked out at once
+POOL_TIMEOUT = 10.0          # seconds to wait for a free connection
+POOL_HEALTH_CHECK = 30.0     # ping connections idle longer than this (None = never)
+BUSY_TIMEOUT_MS = 5000       # how long a writer waits on SQLite's lock
+SYNCHRONOUS = "NORMAL"       # safe with WAL, far fewer fsyncs than FULL
+
+# --- GROUP COMMIT (optional write-behind) ---
+WRITE_BEHIND = False         # route writes through one writer thread that commits in batches
+GROUP_COMMIT_MAX_BATCH = 64  # max write ops per commit
+GROUP_COMMIT_MAX_DELAY = 0.005  # seconds the writer waits to fill a batch after the first op
+
+# --- SHARDING (optional) ---
+SHARDED = False              # each vendor's orders and queue state live in their own file (see shard_file)
+ORDER_ID_STRIDE = 10 ** 9    # vendor v's order ids start above v * ORDER_ID_STRIDE, so an id names its shard
+CATALOG_TABLES = ("users", "vendors", "menu")  # shared tables that shard connections read from DB_FILE
+
+# --- ARCHIVAL ---
+ARCHIVE_AFTER_DAYS = 7       # finished orders older than this leave the live table
+ARCHIVE_BATCH_SIZE = 500     # rows moved per short write transaction
+ARCHIVE_INTERVAL = 15 * 60   # seconds between background archival runs
+VACUUM_PAGES = 2000          # pages returned to the OS per incremental vacuum
+
+# --- NO-SHOW SWEEPER ---
+NO_SHOW_AFTER_MIN = 20       # Ready orders uncollected this long are expired as no-shows
+NO_SHOW_PENALTY = 10         # karma docked per no-show
+SWEEP_INTERVAL = 60          # seconds between background sweeps
+
+# --- PICKUP DEADLINES ---
+START_BUFFER_MIN = 2         # kitchen starts an order this long before prep time alone would require
+DEFAULT_PREP_MIN = 5         # prep time for items no longer on the menu
+
+# --- USER PROFILE CACHE ---
+PROFILE_CACHE_SIZE = 2048    # student profiles kept in memory (least recently used evicted)
+PROFILE_CACHE_TTL = 30.0     # seconds before a cached profile is re-read (bounds karma changed by other processes)
+BAN_THRESHOLD = 40           # karma below this suspends the account
+
+# --- READ COALESCING ---
+COALESCE_MAX_STALENESS = 1.0  # seconds a per-vendor read may be reused by other sessions (0 = only share in-flight queries)
+
+# --- DEMAND HISTOGRAMS ---
+DEMAND_BUCKET_MIN = 15       # width of a demand histogram bucket
+
+# --- ONLINE PREP-TIME LEARNING ---
+EWMA_ALPHA = 0.2             # weight of the newest observation
+SERVICE_GAP_CAP_MIN = 30     # longer gaps between Ready events mean the kitchen was idle
+
+
+def connect(db_file, **kwargs):
+    """Open a tuned connection; pragmas are applied once per physical connection, not per query."""
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           factory=metrics.InstrumentedConnection, **kwargs)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout={int(BUSY_TIMEOUT_MS)}")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    return conn
+
+def connect_shard(shard_file, catalog_file, **kwargs):
+    """
+    Open a vendor shard with the shared file attached read-only as `catalog`.
+    TEMP views named after CATALOG_TABLES shadow the shard's own (empty)
+    copies, so existing joins against users/vendors/menu work unchanged.
+    Because the attachment is read-only, BEGIN IMMEDIATE only takes this
+    shard's write lock, never the catalog's.
+    """
+    conn = connect(shard_file, uri=True, **kwargs)
+    conn.execute("ATTACH DATABASE ? AS catalog", (f"file:{os.path.abspath(catalog_file)}?mode=ro",))
+    for table in CATALOG_TABLES:
+        conn.execute(f"CREATE TEMP VIEW {table} AS SELECT * FROM catalog.{table}")
+    return conn
+
+
+class ConnectionPool:
+    """Bounded pool of WAL-mode SQLite connections shared across Streamlit sessions."""
+
+    def __init__(self, db_file, size=POOL_SIZE, timeout=POOL_TIMEOUT, health_check=POOL_HEALTH_CHECK):
+        self.db_file = db_file
+        self.timeout = timeout
+        self.health_check = health_check
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+
+    def _connect(self):
+        return connect(self.db_file)
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self):
+        if self._closed:
+            raise sqlite3.OperationalError("connection pool is closed")
+        if not self._slots.acquire(timeout=self.timeout):
+            raise sqlite3.OperationalError("connection pool exhausted")
+        try:
+            while True:
+                try:
+                    conn, idle_since = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                stale = self.health_check is not None and time.monotonic() - idle_since > self.health_check
+                if stale and not self._is_healthy(conn):
+                    conn.close()
+                    continue
+                return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        try:
+            # Never hand a half-finished transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.put((conn, time.monotonic()))
+        except sqlite3.Error:
+            conn.close()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Drain idle connections; connections still checked out close on release."""
+        self._closed = True
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+
+
+class ShardPool(ConnectionPool):
+    """Connection pool for one vendor shard; every connection has the catalog attached."""
+
+    def __init__(self, db_file, catalog_file, size=POOL_SIZE, timeout=POOL_TIMEOUT, health_check=POOL_HEALTH_CHECK):
+        super().__init__(db_file, size, timeout, health_check)
+        self.catalog_file = catalog_file
+
+    def _connect(self):
+        return connect_shard(self.db_file, self.catalog_file)
+
+
+_pool = None
+_shard_pools = {}   # vendor_id -> ShardPool
+_pool_lock = threading.Lock()
+
+def shard_file(vendor_id):
+    """Path of a vendor's shard, next to DB_FILE: canteen.db -> canteen.vendor3.db."""
+    root, ext = os.path.splitext(DB_FILE)
+    return f"{root}.vendor{int(vendor_id)}{ext or '.db'}"
+
+def _get_pool(shard=None):
+    """The shared file's pool, or vendor `shard`'s pool when SHARDED."""
+    global _pool
+    if SHARDED and shard is not None:
+        return _get_shard_pool(shard)
+    with _pool_lock:
+        if _pool is None or _pool.db_file != DB_FILE:
+            if _pool is not None:
+                _pool.close()
+                _profiles.invalidate()
+                _catalog.invalidate()
+            _pool = ConnectionPool(DB_FILE, POOL_SIZE, POOL_TIMEOUT, POOL_HEALTH_CHECK)
+        return _pool
+
+class UnknownShardError(LookupError):
+    """A vendor id, or an order id's range, that names no vendor shard."""
+
+def _get_shard_pool(vendor_id):
+    path = shard_file(vendor_id)
+    with _pool_lock:
+        pool = _shard_pools.get(vendor_id)
+        if pool is not None and pool.db_file == path and pool.catalog_file == DB_FILE:
+            return pool
+    # Only init_db creates shards: ids from requests can open existing vendors' files, never new ones
+    if vendor_id not in _shard_ids() or not os.path.exists(path):
+        raise UnknownShardError(f"no shard for vendor {vendor_id}")
+    with _pool_lock:
+        pool = _shard_pools.get(vendor_id)
+        if pool is None or pool.db_file != path or pool.catalog_file != DB_FILE:
+            if pool is not None:
+                pool.close()
+            pool = _shard_pools[vendor_id] = ShardPool(path, DB_FILE, POOL_SIZE, POOL_TIMEOUT, POOL_HEALTH_CHECK)
+        return pool
+
+def close_pool():
+    """Drain the connection pools (call on shutdown or before swapping DB_FILE)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+        for pool in _shard_pools.values():
+            pool.close()
+        _shard_pools.clear()
+
+atexit.register(close_pool)
+
+@contextmanager
+def get_db(shard=None):
+    """Borrow a pooled connection (to vendor `shard`'s file when SHARDED); it is returned (not closed) on exit."""
+    pool = _get_pool(shard)
+    conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
+        pool.release(conn)
+
+def _shard_ids():
+    """Vendor ids, i.e. every shard a cross-vendor read has to visit."""
+    return [v["id"] for v in get_all_vendors()]
+
+def _order_shard(order_id):
+    """The shard holding `order_id` (None when not SHARDED); UnknownShardError if its id range names no vendor."""
+    if not SHARDED:
+        return None
+    vendor_id = int(order_id) // ORDER_ID_STRIDE
+    if vendor_id not in _shard_ids():
+        raise UnknownShardError(f"order {order_id} is in no vendor's id range")
+    return vendor_id
+
+def _fan_out(read, shards=None):
+    """
+    `read(conn)` once on the shared file, or when SHARDED on every vendor
+    shard (or just `shards`). Returns the per-file results in a list.
+    """
+    if not SHARDED:
+        with get_db() as conn:
+            return [read(conn)]
+    results = []
+    for shard in _shard_ids() if shards is None else shards:
+        with get_db(shard) as conn:
+            results.append(read(conn))
+    return results
+
+def _merged(parts, key, limit=None):
+    """Rows from several files as dicts, newest (largest key) first."""
+    rows = sorted((dict(r) for part in parts for r in part), key=key, reverse=True)
+    return rows if limit is None else rows[:limit]
+
+# --- WRITE PATH ---
+
+class GroupCommitWriter:
+    """
+    Single writer thread that drains a queue of write ops and commits them
+    in small batches, so concurrent sessions share one fsync instead of
+    queueing on SQLite's write lock. Each op runs in its own SAVEPOINT, so a
+    failing op is rolled back alone. Futures resolve only after the batch
+    commits.
+    """
+
+    def __init__(self, db_file, max_batch=GROUP_COMMIT_MAX_BATCH, max_delay=GROUP_COMMIT_MAX_DELAY, opener=connect):
+        self.db_file = db_file
+        self.opener = opener
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._stopping = False
+        self._metrics_lock = threading.Lock()
+        self.metrics = {"ops": 0, "batches": 0, "failed_ops": 0, "max_batch": 0, "max_queue_depth": 0,
+                        "batch_sizes": {}, "commit_seconds": 0.0}
+        self._thread = threading.Thread(target=self._run, name="canteen-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, op, *args):
+        if self._stopping:
+            raise sqlite3.OperationalError("write queue is closed")
+        fut = Future()
+        self._queue.put((op, args, fut))
+        with self._metrics_lock:
+            self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], self._queue.qsize())
+        return fut
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=max(0, remaining)) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # let the loop see the stop marker after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        conn = self.opener(self.db_file, isolation_level=None)
+        try:
+            while True:
+                batch = self._collect()
+                if batch is None:
+                    return
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch):
+        started = time.perf_counter()
+        results = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op, args, fut in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((fut, True, op(conn, *args)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((fut, False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            results = [(fut, False, e) for _, _, fut in batch]
+        with self._metrics_lock:
+            m = self.metrics
+            m["ops"] += len(batch)
+            m["batches"] += 1
+            m["failed_ops"] += sum(1 for _, ok, _ in results if not ok)
+            m["max_batch"] = max(m["max_batch"], len(batch))
+            m["batch_sizes"][len(batch)] = m["batch_sizes"].get(len(batch), 0) + 1
+            m["commit_seconds"] += time.perf_counter() - started
+        for fut, ok, value in results:
+            if ok:
+                fut.set_result(value)
+            else:
+                fut.set_exception(value)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=5.0):
+        """Flush everything already queued, then stop the thread."""
+        self._stopping = True
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_writers = {}   # None (shared file) or vendor_id -> GroupCommitWriter
+
+def _get_writer(shard=None):
+    sharded = SHARDED and shard is not None
+    if sharded:
+        _get_shard_pool(shard)  # UnknownShardError unless init_db created this vendor's shard
+    key, db_file = (shard, shard_file(shard)) if sharded else (None, DB_FILE)
+    with _pool_lock:
+        writer = _writers.get(key)
+        if writer is None or writer.db_file != db_file:
+            if writer is not None:
+                writer.stop()
+            opener = partial(connect_shard, catalog_file=DB_FILE) if sharded else connect
+            writer = _writers[key] = GroupCommitWriter(db_file, GROUP_COMMIT_MAX_BATCH, GROUP_COMMIT_MAX_DELAY, opener)
+        return writer
+
+def stop_writer():
+    """Flush and stop the group-commit writers, if any are running."""
+    with _pool_lock:
+        for writer in _writers.values():
+            writer.stop()
+        _writers.clear()
+
+atexit.register(stop_writer)
+
+def get_write_metrics():
+    """Group-commit counters summed over every writer (one per shard when SHARDED): ops, batches, batch sizes, queue depth."""
+    with _pool_lock:
+        writers = list(_writers.values())
+    if not writers:
+        return {"enabled": WRITE_BEHIND, "queue_depth": 0}
+    m = {"ops": 0, "batches": 0, "failed_ops": 0, "max_batch": 0, "max_queue_depth": 0,
+         "batch_sizes": {}, "commit_seconds": 0.0}
+    for writer in writers:
+        with writer._metrics_lock:
+            w = writer.metrics
+            for k in ("ops", "batches", "failed_ops", "commit_seconds"):
+                m[k] += w[k]
+            m["max_batch"] = max(m["max_batch"], w["max_batch"])
+            m["max_queue_depth"] = max(m["max_queue_depth"], w["max_queue_depth"])
+            for size, n in w["batch_sizes"].items():
+                m["batch_sizes"][size] = m["batch_sizes"].get(size, 0) + n
+    m["enabled"] = WRITE_BEHIND
+    m["writers"] = len(writers)
+    m["queue_depth"] = sum(writer.queue_depth() for writer in writers)
+    m["avg_batch"] = m["ops"] / m["batches"] if m["batches"] else 0.0
+    return m
+
+def submit_write(op, *args, shard=None):
+    """Queue `op(conn, *args)` on the group-commit writer (vendor `shard`'s when SHARDED); returns a Future acknowledged after commit."""
+    return _get_writer(shard).submit(op, *args)
+
+def _write(op, *args, shard=None):
+    """
+    Run a write op on the shared file, or on vendor `shard`'s file when
+    SHARDED: via the group-commit writer when WRITE_BEHIND is on, else on a
+    pooled connection.
+    """
+    if WRITE_BEHIND:
+        return submit_write(op, *args, shard=shard).result()
+    with get_db(shard) as conn:
+        result = op(conn, *args)
+        conn.commit()
+        return result
+
+def _write_shards(ops):
+    """
+    Run {vendor_id: (op, *args)} as one unit across shards. Each shard's
+    transaction is opened in vendor-id order, so two multi-vendor writes
+    can't deadlock, and nothing commits until every op has succeeded.
+    (SQLite can't commit WAL files atomically together, so a crash between
+    the final commits can still leave some shards written.) Returns
+    {vendor_id: result}.
+    """
+    if len(ops) == 1:
+        ((shard, (op, *args)),) = ops.items()
+        return {shard: _write(op, *args, shard=shard)}
+    with ExitStack() as stack:
+        conns, results = {}, {}
+        for shard in sorted(ops):
+            conn = conns[shard] = stack.enter_context(get_db(shard))
+            conn.execute("BEGIN IMMEDIATE")
+            op, *args = ops[shard]
+            results[shard] = op(conn, *args)
+        for shard in sorted(ops):
+            conns[shard].commit()
+        return results
+
+# --- SCHEMA MIGRATIONS ---
+# Each step runs once, in order, inside its own transaction; PRAGMA user_version
+# records how many steps a database file has already applied.
+
+def _columns(cursor, table):
+    return [r[1] for r in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+def _migrate_base_schema(cursor):
+    # 1. Users Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            roll_no TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            pin TEXT NOT NULL,
+            points INTEGER DEFAULT 100
+        )
+    """)
+    
+    # 2. Vendors Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vendors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            image_url TEXT
+        )
+    """)
+
+    # 3. Admins Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS admins (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL
+        )
+    """)
+    
+    # 4. Menu Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS menu (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vendor_id INTEGER NOT NULL,
+            item_name TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            avg_prep_time INTEGER NOT NULL,
+            image_url TEXT,
+            is_active INTEGER DEFAULT 1,
+            FOREIGN KEY (vendor_id) REFERENCES vendors(id)
+        )
+    """)
+    
+    # 5. Orders Table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            token_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            student_name TEXT, -- Legacy support
+            vendor_id INTEGER NOT NULL,
+            item_name TEXT NOT NULL,
+            status TEXT DEFAULT 'Received',
+            order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            predicted_pickup_time TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(roll_no),
+            FOREIGN KEY (vendor_id) REFERENCES vendors(id)
+        )
+    """)
+
+    # Legacy databases created before these columns existed
+    if "points" not in _columns(cursor, "users"):
+        cursor.execute("ALTER TABLE users ADD COLUMN points INTEGER DEFAULT 100")
+    cols = _columns(cursor, "orders")
+    if "student_name" not in cols:
+        cursor.execute("ALTER TABLE orders ADD COLUMN student_name TEXT")
+    if "student_id" in cols and "user_id" not in cols:
+        cursor.execute("ALTER TABLE orders RENAME COLUMN student_id TO user_id")
+
+def _migrate_hot_path_indexes(cursor):
+    # Partial indexes only hold live orders, so they stay small however many
+    # Collected/Expired rows pile up. The WHERE clause must match the queries'.
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_orders_vendor_active
+                      ON orders(vendor_id, order_time)
+                      WHERE status NOT IN ('Collected', 'Expired')""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_orders_user_active
+                      ON orders(user_id, order_time)
+                      WHERE status NOT IN ('Collected', 'Expired')""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_menu_item_name ON menu(item_name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_menu_vendor ON menu(vendor_id, is_active)")
+
+def _migrate_queue_state(cursor):
+    # Per-vendor, per-status order counters kept in step with `orders` by
+    # triggers, so every writer (app, scripts, sweepers) maintains them.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS vendor_queue_state (
+            vendor_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            n INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, status)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_queue_insert AFTER INSERT ON orders BEGIN
+            INSERT INTO vendor_queue_state (vendor_id, status, n) VALUES (NEW.vendor_id, NEW.status, 1)
+            ON CONFLICT (vendor_id, status) DO UPDATE SET n = n + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_queue_update AFTER UPDATE OF status, vendor_id ON orders
+        WHEN OLD.status IS NOT NEW.status OR OLD.vendor_id IS NOT NEW.vendor_id BEGIN
+            UPDATE vendor_queue_state SET n = n - 1 WHERE vendor_id = OLD.vendor_id AND status = OLD.status;
+            INSERT INTO vendor_queue_state (vendor_id, status, n) VALUES (NEW.vendor_id, NEW.status, 1)
+            ON CONFLICT (vendor_id, status) DO UPDATE SET n = n + 1;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_orders_queue_delete AFTER DELETE ON orders BEGIN
+            UPDATE vendor_queue_state SET n = n - 1 WHERE vendor_id = OLD.vendor_id AND status = OLD.status;
+        END
+    """)
+    _rebuild_queue_state(cursor)
+
+def _migrate_order_events(cursor):
+    # Append-only lifecycle log plus O(1)-updated running estimates
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER NOT NULL,
+            vendor_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            at REAL NOT NULL, -- unix epoch seconds
+            FOREIGN KEY (order_id) REFERENCES orders(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events(order_id, status)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS prep_estimates (
+            vendor_id INTEGER NOT NULL,
+            item_name TEXT NOT NULL DEFAULT '', -- '' = vendor-wide metric
+            metric TEXT NOT NULL,               -- 'prep' (Cooking->Ready) or 'service' (gap between Ready events)
+            n INTEGER NOT NULL DEFAULT 0,
+            mean REAL NOT NULL DEFAULT 0,       -- minutes
+            var REAL NOT NULL DEFAULT 0,
+            last_at REAL,
+            PRIMARY KEY (vendor_id, item_name, metric)
+        ) WITHOUT ROWID
+    """)
+
+def _bump(scope, key):
+    return f"""INSERT INTO change_versions (scope, key, version) VALUES ('{scope}', {key}, 1)
+               ON CONFLICT (scope, key) DO UPDATE SET version = version + 1;"""
+
+def _migrate_change_versions(cursor):
+    # Monotonic counters bumped by triggers on every write, so pages can check
+    # one number per rerun and skip re-querying when nothing changed.
+    # Scopes: ('user', roll_no), ('vendor', vendor_id), ('catalog', 'all').
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_versions (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (scope, key)
+        ) WITHOUT ROWID
+    """)
+    order_bumps = {
+        "INSERT": _bump("vendor", "NEW.vendor_id") + _bump("user", "NEW.user_id"),
+        "UPDATE": _bump("vendor", "NEW.vendor_id") + _bump("user", "NEW.user_id"),
+        "DELETE": _bump("vendor", "OLD.vendor_id") + _bump("user", "OLD.user_id"),
+    }
+    for event, body in order_bumps.items():
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_orders_version_{event.lower()} AFTER {event} ON orders BEGIN {body} END")
+    # An order moved between vendors/users also changes what the old owner sees
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS trg_orders_version_move AFTER UPDATE OF vendor_id, user_id ON orders
+                       WHEN OLD.vendor_id IS NOT NEW.vendor_id OR OLD.user_id IS NOT NEW.user_id
+                       BEGIN {_bump("vendor", "OLD.vendor_id") + _bump("user", "OLD.user_id")} END""")
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_menu_version_{event.lower()} AFTER {event} ON menu "
+                       f"BEGIN {_bump('vendor', row + '.vendor_id')} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_vendors_version_{event.lower()} AFTER {event} ON vendors "
+                       f"BEGIN {_bump('catalog', repr('all'))} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_users_version_update AFTER UPDATE ON users "
+                   f"BEGIN {_bump('user', 'NEW.roll_no')} END")
+
+def _migrate_order_rollups(cursor):
+    # Hourly per-vendor aggregates written alongside each order event, so the
+    # admin dashboards never scan orders. Buckets are local-time hours.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS order_rollup_hourly (
+            vendor_id INTEGER NOT NULL,
+            hour TEXT NOT NULL, -- 'YYYY-MM-DD HH:00'
+            orders INTEGER NOT NULL DEFAULT 0,
+            collected INTEGER NOT NULL DEFAULT 0,
+            expired INTEGER NOT NULL DEFAULT 0,
+            wait_total REAL NOT NULL DEFAULT 0, -- minutes, Received -> Ready
+            wait_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (hour, vendor_id)
+        ) WITHOUT ROWID
+    """)
+    # Backfill from existing orders (no event history, so no wait times)
+    cursor.execute("""INSERT OR REPLACE INTO order_rollup_hourly (vendor_id, hour, orders, collected, expired)
+                      SELECT vendor_id, strftime('%Y-%m-%d %H:00', order_time, 'localtime'), COUNT(*),
+                             SUM(status = 'Collected'), SUM(status = 'Expired')
+                      FROM orders GROUP BY 1, 2""")
+
+def _create_orders_all_view(cursor, columns):
+    cols = ", ".join(columns)
+    cursor.execute("DROP VIEW IF EXISTS orders_all")
+    cursor.execute(f"""CREATE VIEW orders_all AS
+                       SELECT {cols}, 0 AS archived FROM orders
+                       UNION ALL
+                       SELECT {cols}, 1 AS archived FROM orders_archive""")
+
+def _migrate_orders_archive(cursor):
+    # Cold storage for finished orders; orders_all reads across both tables.
+    # Later migrations that add columns to orders must add them here and to the view.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS orders_archive (
+            id INTEGER PRIMARY KEY,
+            token_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            student_name TEXT,
+            vendor_id INTEGER NOT NULL,
+            item_name TEXT NOT NULL,
+            status TEXT,
+            order_time TIMESTAMP,
+            predicted_pickup_time TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_user ON orders_archive(user_id, order_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_archive_vendor ON orders_archive(vendor_id, order_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_finished ON orders(order_time) WHERE status IN ('Collected', 'Expired')")
+    _create_orders_all_view(cursor, ("id", "token_id", "user_id", "student_name", "vendor_id", "item_name",
+                                     "status", "order_time", "predicted_pickup_time"))
+
+def _migrate_token_sequences(cursor):
+    # Per-vendor, per-day token counters; (vendor_id, token_day, token_seq) is unique
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS token_sequences (
+            vendor_id INTEGER NOT NULL,
+            day TEXT NOT NULL, -- local 'YYYY-MM-DD'
+            last_seq INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, day)
+        ) WITHOUT ROWID
+    """)
+    for table in ("orders", "orders_archive"):
+        cols = _columns(cursor, table)
+        if "token_day" not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN token_day TEXT")
+        if "token_seq" not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN token_seq INTEGER")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_token ON orders(vendor_id, token_day, token_seq)")
+    _create_orders_all_view(cursor, ("id", "token_id", "user_id", "student_name", "vendor_id", "item_name",
+                                     "status", "order_time", "predicted_pickup_time", "token_day", "token_seq"))
+
+def _migrate_slot_reservations(cursor):
+    # Orders promised per vendor per pickup slot (slot = epoch minute // scheduler.SLOT_MINUTES)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS slot_reservations (
+            vendor_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            used INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, slot)
+        ) WITHOUT ROWID
+    """)
+
+def _pickup_epoch(pickup, at):
+    """
+    Epoch seconds for a pickup time: a datetime, or an "%I:%M %p" clock time
+    on the local day of `at` (epoch seconds), rolled to the next day if it
+    would be more than 12 hours before `at`. None if it can't be parsed.
+    """
+    if isinstance(pickup, datetime):
+        return int(pickup.timestamp())
+    try:
+        clock = datetime.strptime(pickup, "%I:%M %p")
+    except (TypeError, ValueError):
+        return None
+    base = datetime.fromtimestamp(at)
+    when = base.replace(hour=clock.hour, minute=clock.minute, second=0, microsecond=0)
+    if when < base - timedelta(hours=12):
+        when += timedelta(days=1)
+    return int(when.timestamp())
+
+def _migrate_pickup_deadlines(cursor):
+    # Epoch-second deadlines: pickup_at (promised to the student) and start_by
+    # (latest moment the kitchen can start). start_by is never NULL, so the
+    # earliest-deadline-first queue reads straight off the index.
+    cursor.connection.create_function("pickup_epoch", 2, _pickup_epoch, deterministic=True)
+    for table in ("orders", "orders_archive"):
+        cols = _columns(cursor, table)
+        if "pickup_at" not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN pickup_at INTEGER")
+        if "start_by" not in cols:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN start_by INTEGER")
+        cursor.execute(f"""UPDATE {table} SET pickup_at = pickup_epoch(predicted_pickup_time, CAST(strftime('%s', order_time) AS INTEGER))
+                           WHERE pickup_at IS NULL""")
+        cursor.execute(f"""UPDATE {table} SET start_by = COALESCE(
+                               pickup_at - 60 * (COALESCE((SELECT m.avg_prep_time FROM menu m
+                                                           WHERE m.vendor_id = {table}.vendor_id AND m.item_name = {table}.item_name
+                                                           LIMIT 1), {DEFAULT_PREP_MIN}) + {START_BUFFER_MIN}),
+                               CAST(strftime('%s', order_time) AS INTEGER))
+                           WHERE start_by IS NULL""")
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_orders_vendor_deadline
+                      ON orders(vendor_id, start_by)
+                      WHERE status NOT IN ('Collected', 'Expired')""")
+    _create_orders_all_view(cursor, ("id", "token_id", "user_id", "student_name", "vendor_id", "item_name",
+                                     "status", "order_time", "predicted_pickup_time", "token_day", "token_seq",
+                                     "pickup_at", "start_by"))
+
+def _migrate_no_show_sweeps(cursor):
+    # One row per sweep that expired something
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS no_show_sweeps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            at REAL NOT NULL,             -- unix epoch seconds
+            threshold_min REAL NOT NULL,
+            expired INTEGER NOT NULL,
+            users_penalized INTEGER NOT NULL,
+            order_ids TEXT NOT NULL       -- JSON array
+        )
+    """)
+
+def _migrate_demand_histogram(cursor):
+    # Orders per vendor, local weekday (0 = Monday) and DEMAND_BUCKET_MIN bucket of
+    # the day, plus the trading days seen, so rate = orders / days for that weekday
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS demand_histogram (
+            vendor_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (vendor_id, weekday, bucket)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS demand_days (
+            day TEXT PRIMARY KEY, -- local 'YYYY-MM-DD'
+            weekday INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    local = "datetime(order_time, 'localtime')"
+    for table in ("orders", "orders_archive"):
+        cursor.execute(f"""INSERT INTO demand_histogram (vendor_id, weekday, bucket, orders)
+                           SELECT vendor_id, (CAST(strftime('%w', {local}) AS INTEGER) + 6) % 7,
+                                  (CAST(strftime('%H', {local}) AS INTEGER) * 60 + CAST(strftime('%M', {local}) AS INTEGER)) / {DEMAND_BUCKET_MIN},
+                                  COUNT(*)
+                           FROM {table} WHERE order_time IS NOT NULL GROUP BY 1, 2, 3
+                           ON CONFLICT (vendor_id, weekday, bucket) DO UPDATE SET orders = orders + excluded.orders""")
+        cursor.execute(f"""INSERT OR IGNORE INTO demand_days (day, weekday)
+                           SELECT DISTINCT date({local}), (CAST(strftime('%w', {local}) AS INTEGER) + 6) % 7
+                           FROM {table} WHERE order_time IS NOT NULL""")
+
+def _migrate_sharded_vendors(cursor):
+    # Vendors whose orders and queue state moved into their own shard file
+    # (SHARDED mode). Their rows are gone from the shared file, so a file
+    # with any row here must not be opened unsharded again.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sharded_vendors (
+            vendor_id INTEGER PRIMARY KEY,
+            moved_at REAL NOT NULL
+        )
+    """)
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_hot_path_indexes,
+    _migrate_queue_state,
+    _migrate_order_events,
+    _migrate_change_versions,
+    _migrate_order_rollups,
+    _migrate_orders_archive,
+    _migrate_token_sequences,
+    _migrate_slot_reservations,
+    _migrate_pickup_deadlines,
+    _migrate_no_show_sweeps,
+    _migrate_demand_histogram,
+    _migrate_sharded_vendors,
+]
+
+# Columns shared by orders and orders_archive as of the latest migration.
+# Migrations never read it: each spells out the columns it built orders_all
+# over, so a shipped migration's SQL stays frozen. One that adds order
+# columns extends this tuple and rebuilds the view with its own copy.
+ORDER_COLUMNS = ("id", "token_id", "user_id", "student_name", "vendor_id", "item_name",
+                 "status", "order_time", "predicted_pickup_time", "token_day", "token_seq",
+                 "pickup_at", "start_by")
+
+def migrate(conn):
+    """Apply pending MIGRATIONS; returns the resulting schema version."""
+    cursor = conn.cursor()
+    # An up-to-date schema is the common case: answer it without taking the write lock
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return version
+    while True:
+        # IMMEDIATE takes the write lock so concurrent sessions migrate once
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version >= len(MIGRATIONS):
+                conn.rollback()
+                return version
+            MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+_catalog_source = None       # (DB_FILE, schema version) the catalog cache was last loaded against
 
 def init_db():
-    """Initialize all tables with robust migrations."""
+    """
+    Apply schema migrations and seed the default catalog. Safe to call
+    repeatedly: the catalog cache is only dropped when seeding inserted rows,
+    a migration ran or DB_FILE changed.
+    """
+    global _catalog_source
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(f"SQLite {sqlite3.sqlite_version} is too old; canteen needs "
+                           f"{'.'.join(map(str, MIN_SQLITE_VERSION))}+ (use a Python built against a newer SQLite)")
+    seeded = False
     with get_db() as conn:
+        version = migrate(conn)
         cursor = conn.cursor()
-        
-        # 1. Users Table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                roll_no TEXT PRIMARY KEY,
-                name TEXT NOT NULL,
-                pin TEXT NOT NULL,
-                points INTEGER DEFAULT 100
-            )
-        """)
-        
-        # 2. Vendors Table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS vendors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL,
-                image_url TEXT
-            )
-        """)
-
-        # 3. Admins Table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS admins (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password TEXT NOT NULL
-            )
-        """)
-        
-        # 4. Menu Table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS menu (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vendor_id INTEGER NOT NULL,
-                item_name TEXT NOT NULL,
-                price INTEGER NOT NULL,
-                avg_prep_time INTEGER NOT NULL,
-                image_url TEXT,
-                is_active INTEGER DEFAULT 1,
-                FOREIGN KEY (vendor_id) REFERENCES vendors(id)
-            )
-        """)
-        
-        # 5. Orders Table
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                token_id TEXT NOT NULL,
-                user_id TEXT NOT NULL,
-                student_name TEXT, -- Legacy support
-                vendor_id INTEGER NOT NULL,
-                item_name TEXT NOT NULL,
-                status TEXT DEFAULT 'Received',
-                order_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                predicted_pickup_time TEXT,
-                FOREIGN KEY (user_id) REFERENCES users(roll_no),
-                FOREIGN KEY (vendor_id) REFERENCES vendors(id)
-            )
-        """)
-        
-        # --- MIGRATIONS ---
-        try: cursor.execute("ALTER TABLE users ADD COLUMN points INTEGER DEFAULT 100")
-        except: pass
-
-        try: cursor.execute("ALTER TABLE orders ADD COLUMN student_name TEXT")
-        except: pass
-
-        cursor.execute("PRAGMA table_info(orders)")
-        cols = [r[1] for r in cursor.fetchall()]
-        if "student_id" in cols and "user_id" not in cols:
-            cursor.execute("ALTER TABLE orders RENAME COLUMN student_id TO user_id")
-            
+
         # --- SEED DATA ---
         cursor.execute("SELECT COUNT(*) FROM vendors")
         if cursor.fetchone()[0] == 0:
@@ -107,6 +899,7 @@ def init_db():
                 ("Noodles & Co", "noodle", "123", "https://images.unsplash.com/photo-1612929633738-8fe44f7ec841?w=300")
             ]
             cursor.executemany("INSERT INTO vendors (name, username, password, image_url) VALUES (?, ?, ?, ?)", vendors)
+            seeded = True
         
         cursor.execute("SELECT COUNT(*) FROM admins")
         if cursor.fetchone()[0] == 0:
@@ -126,8 +919,179 @@ def init_db():
                 (3, "Spring Rolls", 80, 7, "https://images.unsplash.com/photo-1563379091339-03b21ab4a4f8?w=300")
             ]
             cursor.executemany("INSERT INTO menu (vendor_id, item_name, price, avg_prep_time, image_url) VALUES (?, ?, ?, ?, ?)", items)
+            seeded = True
         
         conn.commit()
+        _detect_order_schema(conn)
+        if not SHARDED and cursor.execute("SELECT 1 FROM sharded_vendors LIMIT 1").fetchone():
+            raise RuntimeError(f"{DB_FILE} has vendors moved into shard files; open it with SHARDED = True")
+    if seeded or _catalog_source != (DB_FILE, version):
+        _catalog.invalidate()
+        _catalog_source = (DB_FILE, version)
+    if SHARDED:
+        for vendor_id in _shard_ids():
+            _init_shard(vendor_id, shard_file(vendor_id))
+            _get_shard_pool(vendor_id)
+
+def _init_shard(vendor_id, path):
+    """
+    Migrate a vendor's shard and, the first time, move its existing rows over
+    from the shared file: copied in one shard transaction, then released
+    from the shared file in a second. A crash in between leaves the shard
+    seeded and the release is redone by the next init_db.
+    """
+    conn = connect(path)
+    try:
+        migrate(conn)
+    finally:
+        conn.close()
+    conn = connect_shard(path, DB_FILE)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        seeded = conn.execute("SELECT 1 FROM main.sqlite_sequence WHERE name = 'orders' AND seq >= ?",
+                              (vendor_id * ORDER_ID_STRIDE,)).fetchone()
+        if not seeded:
+            _seed_shard(conn, vendor_id)
+        conn.commit()
+    finally:
+        conn.close()
+    _write(_release_vendor_rows, vendor_id)
+
+def _seed_shard(conn, vendor_id):
+    """Copy a vendor's rows out of the shared file, moving order ids into the vendor's id range; caller commits."""
+    offset = vendor_id * ORDER_ID_STRIDE
+    cols = ", ".join(ORDER_COLUMNS)
+    picked = ", ".join(f"id + {offset}" if c == "id" else c for c in ORDER_COLUMNS)
+    for table in ("orders", "orders_archive"):
+        conn.execute(f"INSERT INTO main.{table} ({cols}) SELECT {picked} FROM catalog.{table} WHERE vendor_id = ?",
+                     (vendor_id,))
+    conn.execute(f"""INSERT INTO main.order_events (order_id, vendor_id, status, at)
+                     SELECT order_id + {offset}, vendor_id, status, at FROM catalog.order_events
+                     WHERE vendor_id = ? ORDER BY id""", (vendor_id,))
+    for table in ("order_rollup_hourly", "token_sequences", "slot_reservations", "prep_estimates", "demand_histogram"):
+        conn.execute(f"INSERT INTO main.{table} SELECT * FROM catalog.{table} WHERE vendor_id = ?", (vendor_id,))
+    conn.execute("INSERT OR IGNORE INTO main.demand_days SELECT * FROM catalog.demand_days")
+    _rebuild_queue_state(conn.cursor())
+    # New orders continue inside this vendor's id range
+    conn.execute("UPDATE main.sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'orders'", (offset,))
+    conn.execute("""INSERT INTO main.sqlite_sequence (name, seq) SELECT 'orders', ?
+                    WHERE NOT EXISTS (SELECT 1 FROM main.sqlite_sequence WHERE name = 'orders')""", (offset,))
+
+def _release_vendor_rows(conn, vendor_id):
+    """Delete a vendor's rows (now held by its shard) from the shared file and record the move; caller commits."""
+    if conn.execute("SELECT 1 FROM sharded_vendors WHERE vendor_id = ?", (vendor_id,)).fetchone():
+        return
+    for table in ("order_events", "orders", "orders_archive", "vendor_queue_state", "order_rollup_hourly",
+                  "token_sequences", "slot_reservations", "prep_estimates", "demand_histogram"):
+        conn.execute(f"DELETE FROM {table} WHERE vendor_id = ?", (vendor_id,))
+    conn.execute("INSERT INTO sharded_vendors (vendor_id, moved_at) VALUES (?, ?)", (vendor_id, time.time()))
+
+# Schema facts detected once at startup instead of per insert
+_order_schema = {}
+
+def _detect_order_schema(conn):
+    _order_schema["student_name"] = "student_name" in _columns(conn.cursor(), "orders")
+
+def _orders_have_student_name(conn):
+    if "student_name" not in _order_schema:
+        _detect_order_schema(conn)
+    return _order_schema["student_name"]
+
+# --- USER PROFILE CACHE ---
+
+class ProfileCache:
+    """
+    Bounded LRU of student profiles ({roll_no, name, points, banned}) shared
+    by all sessions in this process. Karma writers in this module update it
+    after their transaction commits (write-through); it never holds PINs.
+    Karma written by other processes is picked up when the caller's
+    ("user", roll_no) change version moves past the one a profile was cached
+    under, and otherwise after PROFILE_CACHE_TTL.
+    """
+
+    def __init__(self, size=PROFILE_CACHE_SIZE):
+        self.size = size
+        self._items = OrderedDict()   # roll_no -> (profile, change version or None, monotonic load time)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.stale = 0
+
+    def get(self, roll_no, version=None):
+        with self._lock:
+            entry = self._items.get(roll_no)
+            if entry is not None and ((version is not None and entry[1] != version)
+                                      or time.monotonic() - entry[2] > PROFILE_CACHE_TTL):
+                del self._items[roll_no]
+                self.stale += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(roll_no)
+            self.hits += 1
+            return dict(entry[0])
+
+    def put(self, profile, version=None):
+        with self._lock:
+            self._items[profile["roll_no"]] = (dict(profile), version, time.monotonic())
+            self._items.move_to_end(profile["roll_no"])
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def set_points(self, roll_no, points):
+        with self._lock:
+            entry = self._items.get(roll_no)
+            if entry is not None:
+                entry[0]["points"], entry[0]["banned"] = points, points < BAN_THRESHOLD
+
+    def invalidate(self, roll_no=None):
+        with self._lock:
+            if roll_no is None:
+                self._items.clear()
+            else:
+                self._items.pop(roll_no, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._items), "capacity": self.size, "hits": self.hits,
+                    "misses": self.misses, "stale": self.stale, "evictions": self.evictions}
+
+_profiles = ProfileCache()
+
+def _profile_from_row(row):
+    return {"roll_no": row["roll_no"], "name": row["name"], "points": row["points"],
+            "banned": row["points"] < BAN_THRESHOLD}
+
+def authenticate_user(roll_no, pin):
+    """Check a student's PIN and load their profile (name, points, banned) in one query; None if invalid."""
+    roll = roll_no.strip()
+    with get_db() as conn:
+        row = conn.execute("SELECT roll_no, name, pin, points FROM users WHERE roll_no = ?", (roll,)).fetchone()
+    if row is None or row["pin"] != pin:
+        return None
+    profile = _profile_from_row(row)
+    _profiles.put(profile)
+    return profile
+
+def get_user_profile(roll_no, version=None):
+    """
+    A student's {roll_no, name, points, banned}, from the profile cache when
+    possible; None if unknown. `version` is the caller's current ("user",
+    roll_no) change version: a profile cached under another one is re-read.
+    """
+    roll = roll_no.strip()
+    profile = _profiles.get(roll, version)
+    if profile is None:
+        with get_db() as conn:
+            row = conn.execute("SELECT roll_no, name, points FROM users WHERE roll_no = ?", (roll,)).fetchone()
+        if row is None:
+            return None
+        profile = _profile_from_row(row)
+        _profiles.put(profile, version)
+    return profile
+
+def get_profile_cache_stats():
+    return _profiles.stats()
 
 # --- REFACTORED FUNCTIONS ---
 
@@ -140,9 +1104,8 @@ def register_user(roll_no, name, pin):
     except sqlite3.IntegrityError: return False
 
 def verify_user(roll_no, pin):
-    with get_db() as conn:
-        row = conn.execute("SELECT name, points FROM users WHERE roll_no = ? AND pin = ?", (roll_no.strip(), pin)).fetchone()
-        return dict(row) if row else None
+    user = authenticate_user(roll_no, pin)
+    return {"name": user["name"], "points": user["points"]} if user else None
 
 def verify_vendor(username, password):
     with get_db() as conn:
@@ -160,82 +1123,843 @@ def get_item_prep_time_by_name(item_name):
         return row["avg_prep_time"] if row else 5
 
 def check_ban_status(roll_no):
-    with get_db() as conn:
-        row = conn.execute("SELECT points FROM users WHERE roll_no = ?", (roll_no.strip(),)).fetchone()
-        return row["points"] < 40 if row else False
+    profile = get_user_profile(roll_no)
+    return profile["banned"] if profile else False
 
-def get_user_points(roll_no):
-    with get_db() as conn:
-        row = conn.execute("SELECT points FROM users WHERE roll_no = ?", (roll_no.strip(),)).fetchone()
-        return row["points"] if row else 0
+def get_user_points(roll_no, version=None):
+    profile = get_user_profile(roll_no, version)
+    return profile["points"] if profile else 0
+
+def _deduct_points(conn, roll_no, amount):
+    conn.execute("UPDATE users SET points = MAX(0, points - ?) WHERE roll_no = ?", (amount, roll_no.strip()))
+    row = conn.execute("SELECT points FROM users WHERE roll_no = ?", (roll_no.strip(),)).fetchone()
+    return row["points"] if row else None
 
 def deduct_points(roll_no, amount=10):
-    with get_db() as conn:
-        conn.execute("UPDATE users SET points = MAX(0, points - ?) WHERE roll_no = ?", (amount, roll_no.strip()))
-        conn.commit()
-        return True
+    pts = _write(_deduct_points, roll_no, amount)
+    if pts is not None:
+        _profiles.set_points(roll_no.strip(), pts)
+    return True
+
+# --- CATALOG CACHE ---
+
+class CatalogCache:
+    """
+    In-process vendor list and per-vendor menus. Each vendor has a version
+    that menu writers in this module bump after commit; a bump drops only
+    that vendor's snapshot. Readers share immutable snapshots (tuples of
+    read-only mappings) and never touch SQLite on a hit. Sessions that miss
+    together share one load (see ReadCoalescer).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}     # vendor_id -> version ('*' for the vendor list)
+        self._snapshots = {}    # vendor_id -> (version, all_items, active_items)
+        self.hits = self.misses = self.invalidations = 0
+
+    def version(self, vendor_id):
+        with self._lock:
+            return self._versions.get(vendor_id, 0)
+
+    def _lookup(self, key, loader):
+        with self._lock:
+            version = self._versions.get(key, 0)
+            entry = self._snapshots.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = (version,) + _coalesced.read(("catalog", key, version), loader, max_staleness=0)
+        with self._lock:
+            # Don't store a snapshot that an invalidation raced past
+            if self._versions.get(key, 0) == version:
+                self._snapshots[key] = entry
+        return entry
+
+    def vendors(self):
+        def load():
+            with get_db() as conn:
+                return (tuple(MappingProxyType(dict(r)) for r in conn.execute("SELECT * FROM vendors")),)
+        return self._lookup("*", load)[1]
+
+    def menu(self, vendor_id, active_only=True):
+        def load():
+            with get_db() as conn:
+                items = tuple(MappingProxyType(dict(r)) for r in conn.execute("SELECT * FROM menu WHERE vendor_id = ?", (vendor_id,)))
+            return items, tuple(m for m in items if m["is_active"] == 1)
+        entry = self._lookup(vendor_id, load)
+        return entry[2] if active_only else entry[1]
+
+    def invalidate(self, vendor_id=None):
+        """Bump one vendor's version (None = every vendor and the vendor list)."""
+        with self._lock:
+            keys = list(self._versions.keys() | self._snapshots.keys()) if vendor_id is None else [vendor_id]
+            for key in keys:
+                self._versions[key] = self._versions.get(key, 0) + 1
+                self._snapshots.pop(key, None)
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                    "vendors_cached": len(self._snapshots)}
+
+_catalog = CatalogCache()
 
 def get_all_vendors():
-    with get_db() as conn:
-        return [dict(r) for r in conn.execute("SELECT * FROM vendors").fetchall()]
+    """All vendors as an immutable snapshot (tuple of read-only mappings)."""
+    return _catalog.vendors()
 
 def get_menu(vendor_id, active_only=True):
-    with get_db() as conn:
-        query = "SELECT * FROM menu WHERE vendor_id = ?" + (" AND is_active = 1" if active_only else "")
-        return [dict(r) for r in conn.execute(query, (vendor_id,)).fetchall()]
+    """A vendor's menu as an immutable snapshot, served from the catalog cache."""
+    return _catalog.menu(vendor_id, active_only)
+
+def get_catalog_version(vendor_id):
+    return _catalog.version(vendor_id)
+
+def get_catalog_cache_stats():
+    return _catalog.stats()
+
+def invalidate_catalog(vendor_id=None):
+    """Drop cached catalog snapshots after another process changed them (None = everything)."""
+    _catalog.invalidate(vendor_id)
+
+def _toggle_item_availability(conn, item_id, status):
+    conn.execute("UPDATE menu SET is_active = ? WHERE id = ?", (1 if status else 0, item_id))
+    row = conn.execute("SELECT vendor_id FROM menu WHERE id = ?", (item_id,)).fetchone()
+    return row["vendor_id"] if row else None
 
 def toggle_item_availability(item_id, status):
-    with get_db() as conn:
-        conn.execute("UPDATE menu SET is_active = ? WHERE id = ?", (1 if status else 0, item_id))
-        conn.commit()
+    vendor_id = _write(_toggle_item_availability, item_id, status)
+    if vendor_id is not None:
+        _catalog.invalidate(vendor_id)
+
+# --- READ COALESCING ---
+
+class ReadCoalescer:
+    """
+    Single-flight for per-vendor reads that every session on a stall page
+    repeats (queue counts, prep estimates, catalog loads). The first caller
+    for a key runs the query; callers arriving while it runs wait for the
+    same result, and callers within `max_staleness` seconds of its start
+    reuse it, so read load follows the number of vendors rather than the
+    number of sessions. Order writers in this module invalidate a vendor
+    after commit; the staleness bound covers writes from other processes.
+    Results are shared, so loaders return immutable values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}      # (read, vendor_id, ...) -> (monotonic start, Future)
+        self._counts = {}       # read -> [calls, loads]
+        self.calls = self.loads = self.joined = self.reused = self.invalidations = 0
+
+    def read(self, key, loader, max_staleness=None):
+        max_staleness = COALESCE_MAX_STALENESS if max_staleness is None else max_staleness
+        with self._lock:
+            self.calls += 1
+            counts = self._counts.setdefault(key[0], [0, 0])
+            counts[0] += 1
+            flight = self._flights.get(key)
+            if flight is not None and not flight[1].done():
+                self.joined += 1
+            elif flight is not None and time.monotonic() - flight[0] <= max_staleness:
+                self.reused += 1
+            else:
+                flight = None
+                future = Future()
+                self._flights[key] = (time.monotonic(), future)
+                self.loads += 1
+                counts[1] += 1
+        if flight is not None:
+            return flight[1].result()
+        try:
+            result = loader()
+        except BaseException as e:
+            self._drop(key, future)
+            future.set_exception(e)
+            raise
+        if max_staleness <= 0:
+            self._drop(key, future)
+        future.set_result(result)
+        return result
+
+    def _drop(self, key, future):
+        with self._lock:
+            if self._flights.get(key, (None, None))[1] is future:
+                del self._flights[key]
+
+    def invalidate(self, vendor_id=None):
+        """Stop sharing one vendor's results (None = every vendor); reads already waiting keep theirs."""
+        with self._lock:
+            for key in [k for k in self._flights if vendor_id is None or k[1] == vendor_id]:
+                del self._flights[key]
+            self.invalidations += 1
+
+    def stats(self):
+        """Counters plus fan-in (calls per query actually run), overall and per read."""
+        with self._lock:
+            return {"calls": self.calls, "loads": self.loads, "joined": self.joined, "reused": self.reused,
+                    "invalidations": self.invalidations,
+                    "fan_in": round(self.calls / self.loads, 1) if self.loads else None,
+                    "by_read": {name: round(c / n, 1) if n else None for name, (c, n) in self._counts.items()}}
+
+_coalesced = ReadCoalescer()
+
+def get_read_coalescing_stats():
+    return _coalesced.stats()
+
+def invalidate_shared_reads(vendor_id=None):
+    """Drop shared per-vendor reads after another process changed the vendor's orders (None = every vendor)."""
+    _coalesced.invalidate(vendor_id)
+
+TOKEN_PREFIX = "#VR-"
+
+def _place_order_batch(conn, user_id, lines):
+    uid = user_id.strip()
+    at = time.time()
+    day = time.strftime("%Y-%m-%d", time.localtime(at))
+    user_row = conn.execute("SELECT name FROM users WHERE roll_no = ?", (uid,)).fetchone()
+    name = user_row["name"] if user_row else "Unknown"
+
+    # One sequence bump per vendor reserves a block of tokens
+    per_vendor = {}
+    for line in lines:
+        per_vendor[line[0]] = per_vendor.get(line[0], 0) + 1
+        if len(line) > 3 and line[3] is not None:
+            _reserve_slot(conn, line[0], *line[3])
+    next_seq = {}
+    for vendor_id, count in per_vendor.items():
+        conn.execute("""INSERT INTO token_sequences (vendor_id, day, last_seq) VALUES (?, ?, ?)
+                        ON CONFLICT (vendor_id, day) DO UPDATE SET last_seq = last_seq + excluded.last_seq""",
+                     (vendor_id, day, count))
+        last = conn.execute("SELECT last_seq FROM token_sequences WHERE vendor_id = ? AND day = ?", (vendor_id, day)).fetchone()[0]
+        next_seq[vendor_id] = last - count + 1
+
+    preps = {}
+    for vendor_id in per_vendor:
+        for r in conn.execute("SELECT item_name, avg_prep_time FROM menu WHERE vendor_id = ?", (vendor_id,)):
+            preps.setdefault((vendor_id, r["item_name"]), r["avg_prep_time"])
+
+    rows = []
+    for vendor_id, item_name, prediction, *_ in lines:
+        seq = next_seq[vendor_id]
+        next_seq[vendor_id] += 1
+        pickup_at = _pickup_epoch(prediction, at)
+        if isinstance(prediction, datetime):
+            prediction = prediction.strftime("%I:%M %p")
+        prep = preps.get((vendor_id, item_name), DEFAULT_PREP_MIN)
+        start_by = pickup_at - 60 * (prep + START_BUFFER_MIN) if pickup_at is not None else int(at)
+        rows.append((f"{TOKEN_PREFIX}{seq:03d}", day, seq, uid, name, vendor_id, item_name, prediction, pickup_at, start_by))
+    if _orders_have_student_name(conn):
+        conn.executemany("""INSERT INTO orders (token_id, token_day, token_seq, user_id, student_name, vendor_id, item_name,
+                                                predicted_pickup_time, pickup_at, start_by)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+    else:
+        conn.executemany("""INSERT INTO orders (token_id, token_day, token_seq, user_id, vendor_id, item_name,
+                                                predicted_pickup_time, pickup_at, start_by)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", [r[:4] + r[5:] for r in rows])
+
+    # Ids come back through the unique token index
+    ids = {}
+    for vendor_id, count in per_vendor.items():
+        first = next_seq[vendor_id] - count
+        for r in conn.execute("""SELECT id, token_seq FROM orders
+                                 WHERE vendor_id = ? AND token_day = ? AND token_seq BETWEEN ? AND ?""",
+                              (vendor_id, day, first, first + count - 1)):
+            ids[(vendor_id, r["token_seq"])] = r["id"]
+    conn.executemany("INSERT INTO order_events (order_id, vendor_id, status, at) VALUES (?, ?, 'Received', ?)",
+                     [(ids[(r[5], r[2])], r[5], at) for r in rows])
+    for vendor_id, count in per_vendor.items():
+        _rollup(conn, vendor_id, at, orders=count)
+        _record_demand(conn, vendor_id, at, count)
+    return [(r[0], ids[(r[5], r[2])]) for r in rows]
+
+def place_order_batch(user_id, lines, with_ids=False):
+    """
+    Place a whole cart in one transaction. `lines` is a list of
+    (vendor_id, item_name, predicted_pickup_time[, (slot, capacity)]); items
+    may span vendors. The pickup time is a datetime or an "%I:%M %p" string;
+    either way pickup_at/start_by deadlines are stored alongside it. Tokens are allocated as one contiguous block per vendor
+    and rows are inserted with executemany. A line with a slot claims one
+    unit of that vendor's pickup-slot capacity; if any slot is already full
+    the whole cart rolls back with SlotFullError. When SHARDED, each
+    vendor's lines go to its own shard (see _write_shards). Returns the
+    tokens in `lines` order, or (token, order_id) pairs with `with_ids`.
+    """
+    if not lines:
+        return []
+    if not SHARDED:
+        placed = _write(_place_order_batch, user_id, list(lines))
+        for vid in {line[0] for line in lines}:
+            _coalesced.invalidate(vid)
+        return placed if with_ids else [token for token, _ in placed]
+    per_vendor = {}
+    for i, line in enumerate(lines):
+        per_vendor.setdefault(line[0], []).append(i)
+    placed = _write_shards({vid: (_place_order_batch, user_id, [lines[i] for i in idx])
+                            for vid, idx in per_vendor.items()})
+    _write(_bump_user_versions, [user_id.strip()])
+    ordered = [None] * len(lines)
+    for vid, idx in per_vendor.items():
+        _coalesced.invalidate(vid)
+        for i, pair in zip(idx, placed[vid]):
+            ordered[i] = pair
+    return ordered if with_ids else [token for token, _ in ordered]
 
 def add_order(user_id, vendor_id, item_name, prediction):
-    token_id = f"#VR-{random.randint(100, 999)}"
-    with get_db() as conn:
-        user_row = conn.execute("SELECT name FROM users WHERE roll_no = ?", (user_id.strip(),)).fetchone()
-        name = user_row["name"] if user_row else "Unknown"
-        cols = [r[1] for r in conn.execute("PRAGMA table_info(orders)").fetchall()]
-        if "student_name" in cols:
-            conn.execute("""INSERT INTO orders (token_id, user_id, student_name, vendor_id, item_name, predicted_pickup_time)
-                            VALUES (?, ?, ?, ?, ?, ?)""", (token_id, user_id.strip(), name, vendor_id, item_name, prediction))
-        else:
-            conn.execute("""INSERT INTO orders (token_id, user_id, vendor_id, item_name, predicted_pickup_time)
-                            VALUES (?, ?, ?, ?, ?)""", (token_id, user_id.strip(), vendor_id, item_name, prediction))
-        conn.commit()
-        return token_id
+    return place_order_batch(user_id, [(vendor_id, item_name, prediction)])[0]
+
+class SlotFullError(sqlite3.IntegrityError):
+    """A pickup slot reached its capacity before the order could claim it."""
+
+def _reserve_slot(conn, vendor_id, slot, capacity):
+    conn.execute("INSERT OR IGNORE INTO slot_reservations (vendor_id, slot, used) VALUES (?, ?, 0)", (vendor_id, slot))
+    cur = conn.execute("UPDATE slot_reservations SET used = used + 1 WHERE vendor_id = ? AND slot = ? AND used < ?",
+                       (vendor_id, slot, capacity))
+    if cur.rowcount == 0:
+        raise SlotFullError(f"slot {slot} for vendor {vendor_id} is full")
+
+def get_slot_usage(vendor_id, first_slot, end_slot):
+    """{slot: orders reserved} for a vendor's slots in [first_slot, end_slot)."""
+    with get_db(vendor_id) as conn:
+        rows = conn.execute("SELECT slot, used FROM slot_reservations WHERE vendor_id = ? AND slot >= ? AND slot < ?",
+                            (vendor_id, first_slot, end_slot)).fetchall()
+        return {r["slot"]: r["used"] for r in rows}
+
+def lookup_by_token(vendor_id, token, day=None):
+    """
+    A vendor's order by token ("#VR-042", "VR-42" or "42") on `day`
+    ("YYYY-MM-DD"), via the unique token index. Without a day it is the
+    newest still-open order with that token, so orders placed before
+    midnight can still be handed over after it and a token reused today by
+    a finished order can't hide one still waiting; failing that, today's
+    finished order with that token.
+    """
+    digits = "".join(ch for ch in str(token) if ch.isdigit())
+    if not digits:
+        return None
+    query = """SELECT o.*, u.name as student_name
+               FROM orders o LEFT JOIN users u ON o.user_id = u.roll_no
+               WHERE o.vendor_id = ? AND o.token_seq = ?"""
+    with get_db(vendor_id) as conn:
+        row = None
+        if day is None:
+            row = conn.execute(query + """ AND o.status NOT IN ('Collected', 'Expired')
+                                           ORDER BY o.token_day DESC LIMIT 1""", (vendor_id, int(digits))).fetchone()
+        if row is None:
+            row = conn.execute(query + " AND o.token_day = ?",
+                               (vendor_id, int(digits), day or time.strftime("%Y-%m-%d"))).fetchone()
+        return dict(row) if row else None
 
 def get_vendor_orders(vendor_id):
-    with get_db() as conn:
+    """Open orders for a vendor, earliest start deadline first."""
+    with get_db(vendor_id) as conn:
         rows = conn.execute("""SELECT o.*, u.name as student_name 
                                FROM orders o JOIN users u ON o.user_id = u.roll_no
                                WHERE o.vendor_id = ? AND o.status NOT IN ('Collected', 'Expired')
-                               ORDER BY o.order_time ASC""", (vendor_id,)).fetchall()
+                               ORDER BY o.start_by, o.id""", (vendor_id,)).fetchall()
         return [dict(r) for r in rows]
 
-def get_user_active_orders(user_id):
-    with get_db() as conn:
-        rows = conn.execute("""SELECT o.*, v.name as vendor_name 
-                               FROM orders o JOIN vendors v ON o.vendor_id = v.id
-                               WHERE o.user_id = ? AND o.status NOT IN ('Collected', 'Expired')
-                               ORDER BY o.order_time DESC""", (user_id.strip(),)).fetchall()
+def get_kds_orders(vendor_id):
+    """
+    Open orders for the kitchen display with each item's prep time joined in
+    (one query), in the order work has to start: earliest start_by first,
+    read in order from idx_orders_vendor_deadline. Ready orders carry
+    ready_at, taken the same way the no-show sweeper takes it.
+    """
+    with get_db(vendor_id) as conn:
+        rows = conn.execute(f"""SELECT o.*, u.name as student_name,
+                                       COALESCE((SELECT m.avg_prep_time FROM menu m
+                                                 WHERE m.vendor_id = o.vendor_id AND m.item_name = o.item_name
+                                                 LIMIT 1), {DEFAULT_PREP_MIN}) as prep_time,
+                                       CAST(strftime('%s', o.order_time) AS INTEGER) as order_at,
+                                       CASE WHEN o.status = 'Ready' THEN
+                                           COALESCE((SELECT MAX(e.at) FROM order_events e
+                                                     WHERE e.order_id = o.id AND e.status = 'Ready'),
+                                                    CAST(strftime('%s', o.order_time) AS INTEGER)) END as ready_at
+                                FROM orders o JOIN users u ON o.user_id = u.roll_no
+                                WHERE o.vendor_id = ? AND o.status NOT IN ('Collected', 'Expired')
+                                ORDER BY o.start_by, o.id""", (vendor_id,)).fetchall()
         return [dict(r) for r in rows]
 
+def get_user_active_orders(user_id):
+    """A student's open orders, newest first (merged across vendor shards when SHARDED)."""
+    uid = user_id.strip()
+    return _merged(_fan_out(lambda conn: conn.execute("""SELECT o.*, v.name as vendor_name 
+                                                         FROM orders o JOIN vendors v ON o.vendor_id = v.id
+                                                         WHERE o.user_id = ? AND o.status NOT IN ('Collected', 'Expired')
+                                                         ORDER BY o.order_time DESC""", (uid,)).fetchall()),
+                   key=lambda r: r["order_time"])
+
 def get_vendor_active_orders_count(vendor_id):
-    with get_db() as conn:
-        return conn.execute("SELECT COUNT(*) FROM orders WHERE vendor_id = ? AND status NOT IN ('Collected', 'Expired')", (vendor_id,)).fetchone()[0]
+    """Live queue length, read from the trigger-maintained counters (no orders scan); shared across sessions."""
+    def load():
+        with get_db(vendor_id) as conn:
+            return conn.execute("""SELECT COALESCE(SUM(n), 0) FROM vendor_queue_state
+                                   WHERE vendor_id = ? AND status NOT IN ('Collected', 'Expired')""", (vendor_id,)).fetchone()[0]
+    return _coalesced.read(("active_count", vendor_id), load)
+
+def get_vendor_queue_state(vendor_id):
+    """Order counts per status for a vendor, e.g. {"Received": 3, "Cooking": 1, ...} (read-only, shared across sessions)."""
+    def load():
+        with get_db(vendor_id) as conn:
+            rows = conn.execute("SELECT status, n FROM vendor_queue_state WHERE vendor_id = ?", (vendor_id,)).fetchall()
+            return MappingProxyType({r["status"]: r["n"] for r in rows})
+    return _coalesced.read(("queue_state", vendor_id), load)
+
+def _rebuild_queue_state(cursor):
+    cursor.execute("DELETE FROM vendor_queue_state")
+    cursor.execute("""INSERT INTO vendor_queue_state (vendor_id, status, n)
+                      SELECT vendor_id, status, COUNT(*) FROM orders
+                      WHERE status IS NOT NULL GROUP BY vendor_id, status""")
+
+def _reconcile_queue_state(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    before = {(r[0], r[1]): r[2] for r in conn.execute("SELECT vendor_id, status, n FROM vendor_queue_state WHERE n != 0")}
+    _rebuild_queue_state(conn.cursor())
+    after = {(r[0], r[1]): r[2] for r in conn.execute("SELECT vendor_id, status, n FROM vendor_queue_state")}
+    conn.commit()
+    return sum(1 for k in before.keys() | after.keys() if before.get(k, 0) != after.get(k, 0))
+
+def reconcile_queue_state():
+    """Recount vendor_queue_state from orders (in every shard when SHARDED); returns how many counters had drifted."""
+    return sum(_fan_out(_reconcile_queue_state))
+
+def _update_status(conn, order_id, new_status):
+    order = conn.execute("SELECT vendor_id, user_id, item_name, status FROM orders WHERE id = ?", (order_id,)).fetchone()
+    conn.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
+    if order and order["status"] != new_status:
+        _record_transition(conn, order_id, order["vendor_id"], order["item_name"], new_status)
+    return (order["vendor_id"], order["user_id"]) if order else (None, None)
 
 def update_status(order_id, new_status):
-    with get_db() as conn:
-        conn.execute("UPDATE orders SET status = ? WHERE id = ?", (new_status, order_id))
-        conn.commit()
+    try:
+        shard = _order_shard(order_id)
+    except UnknownShardError:
+        return  # no such order, as for an unknown id in one file
+    vendor_id, uid = _write(_update_status, order_id, new_status, shard=shard)
+    if vendor_id is not None:
+        if shard is not None:
+            _write(_bump_user_versions, [uid])
+        _coalesced.invalidate(vendor_id)
+
+def _apply_expiry(conn, rows, at, dock=True):
+    """
+    Bookkeeping for orders just set to Expired (rows of id, user_id, vendor_id):
+    one batched event insert, one rollup per vendor and, with `dock`, one
+    karma UPDATE for every affected user, returning {user_id: new_points}.
+    Shard connections can't write users, so they pass dock=False and get
+    {user_id: no-shows} back for _dock_no_shows on the shared file. Caller
+    commits.
+    """
+    if not rows:
+        return {}
+    conn.executemany("INSERT INTO order_events (order_id, vendor_id, status, at) VALUES (?, ?, 'Expired', ?)",
+                     [(r["id"], r["vendor_id"], at) for r in rows])
+    per_vendor, per_user = {}, {}
+    for r in rows:
+        per_vendor[r["vendor_id"]] = per_vendor.get(r["vendor_id"], 0) + 1
+        per_user[r["user_id"]] = per_user.get(r["user_id"], 0) + 1
+    for vendor_id, count in per_vendor.items():
+        _rollup(conn, vendor_id, at, expired=count)
+    return _dock_no_shows(conn, per_user) if dock else per_user
+
+def _dock_no_shows(conn, no_shows, penalty=None):
+    """Dock `penalty` karma per no-show ({user_id: count}) in one UPDATE; returns {user_id: new_points}."""
+    if not no_shows:
+        return {}
+    penalty = NO_SHOW_PENALTY if penalty is None else penalty
+    users = json.dumps(no_shows)
+    conn.execute("""UPDATE users SET points = MAX(0, users.points - ? * j.value)
+                    FROM json_each(?) j WHERE users.roll_no = j.key""", (penalty, users))
+    return {r["roll_no"]: r["points"] for r in conn.execute(
+        "SELECT roll_no, points FROM users WHERE roll_no IN (SELECT key FROM json_each(?))", (users,))}
+
+def _expire_order_with_penalty(conn, order_id, dock=True):
+    rows = conn.execute("""UPDATE orders SET status = 'Expired'
+                           WHERE id = ? AND status NOT IN ('Collected', 'Expired')
+                           RETURNING id, user_id, vendor_id""", (order_id,)).fetchall()
+    points = _apply_expiry(conn, rows, time.time(), dock)
+    if rows:
+        uid = rows[0]["user_id"]
+        return True, uid, points.get(uid, 0), rows[0]["vendor_id"]
+    return False, None, 0, None
 
 def expire_order_with_penalty(order_id):
-    with get_db() as conn:
-        order = conn.execute("SELECT user_id FROM orders WHERE id = ?", (order_id,)).fetchone()
-        if order:
-            conn.execute("UPDATE orders SET status = 'Expired' WHERE id = ?", (order_id,))
-            conn.execute("UPDATE users SET points = MAX(0, points - 10) WHERE roll_no = ?", (order['user_id'],))
-            conn.commit()
-            pts = conn.execute("SELECT points FROM users WHERE roll_no = ?", (order['user_id'],)).fetchone()['points']
-            return True, order['user_id'], pts
+    try:
+        shard = _order_shard(order_id)
+    except UnknownShardError:
         return False, None, 0
+    expired, uid, pts, vendor_id = _write(_expire_order_with_penalty, order_id, shard is None, shard=shard)
+    if expired and shard is not None:
+        # The order committed on its shard; the karma lands in a second transaction on the shared file
+        pts = _write(_dock_no_shows, {uid: pts})[uid]
+    if expired:
+        _profiles.set_points(uid, pts)
+        _coalesced.invalidate(vendor_id)
+    return expired, uid, pts
+
+# --- CHANGE DETECTION ---
+
+def _bump_user_versions(conn, user_ids):
+    """
+    Bump ("user", id) versions in the shared file after an order write
+    committed on a shard, so user keys are only ever read from one file
+    (karma docking bumps them there through the users trigger). Caller commits.
+    """
+    conn.execute("""INSERT INTO change_versions (scope, key, version)
+                    SELECT 'user', value, 1 FROM json_each(?) WHERE true
+                    ON CONFLICT (scope, key) DO UPDATE SET version = version + 1""", (json.dumps(sorted(set(user_ids))),))
+
+def _read_versions(conn, keys):
+    where = " OR ".join("(scope = ? AND key = ?)" for _ in keys)
+    params = [str(part) for pair in keys for part in pair]
+    rows = conn.execute(f"SELECT scope, key, version FROM change_versions WHERE {where}", params).fetchall()
+    found = {(r["scope"], r["key"]): r["version"] for r in rows}
+    return [found.get((scope, str(key)), 0) for scope, key in keys]
+
+def get_change_versions(*keys):
+    """
+    Current versions for (scope, key) pairs in one query, e.g. ("vendor", 2);
+    unseen keys are 0. User and catalog versions always live in the shared
+    file. When SHARDED a vendor's order writes bump its version in its own
+    shard, so a vendor key is the sum of the shared file and that shard.
+    """
+    if not keys:
+        return ()
+    with get_db() as conn:
+        totals = _read_versions(conn, keys)
+    if SHARDED:
+        for shard in _shard_ids():
+            picked = [i for i, (scope, key) in enumerate(keys) if scope == "vendor" and str(key) == str(shard)]
+            if picked:
+                with get_db(shard) as conn:
+                    for i, version in zip(picked, _read_versions(conn, [keys[i] for i in picked])):
+                        totals[i] += version
+    return tuple(totals)
+
+# --- ORDER EVENTS & ONLINE ESTIMATES ---
+
+def _ewma_update(conn, vendor_id, item_name, metric, x, at):
+    """Fold one observation (minutes) into the running EWMA mean/variance."""
+    a = EWMA_ALPHA
+    conn.execute("""INSERT INTO prep_estimates (vendor_id, item_name, metric, n, mean, var, last_at)
+                    VALUES (?, ?, ?, 1, ?, 0, ?)
+                    ON CONFLICT (vendor_id, item_name, metric) DO UPDATE SET
+                        n = n + 1,
+                        mean = mean + ? * (excluded.mean - mean),
+                        var = (1 - ?) * (var + ? * (excluded.mean - mean) * (excluded.mean - mean)),
+                        last_at = excluded.last_at""",
+                 (vendor_id, item_name, metric, x, at, a, a, a))
+
+def _rollup(conn, vendor_id, at, orders=0, collected=0, expired=0, wait=None):
+    hour = time.strftime("%Y-%m-%d %H:00", time.localtime(at))
+    conn.execute("""INSERT INTO order_rollup_hourly (vendor_id, hour, orders, collected, expired, wait_total, wait_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (hour, vendor_id) DO UPDATE SET
+                        orders = orders + excluded.orders,
+                        collected = collected + excluded.collected,
+                        expired = expired + excluded.expired,
+                        wait_total = wait_total + excluded.wait_total,
+                        wait_count = wait_count + excluded.wait_count""",
+                 (vendor_id, hour, orders, collected, expired, wait or 0, 0 if wait is None else 1))
+
+def _record_demand(conn, vendor_id, at, count=1):
+    local = time.localtime(at)
+    bucket = (local.tm_hour * 60 + local.tm_min) // DEMAND_BUCKET_MIN
+    conn.execute("""INSERT INTO demand_histogram (vendor_id, weekday, bucket, orders) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (vendor_id, weekday, bucket) DO UPDATE SET orders = orders + excluded.orders""",
+                 (vendor_id, local.tm_wday, bucket, count))
+    conn.execute("INSERT OR IGNORE INTO demand_days (day, weekday) VALUES (?, ?)",
+                 (time.strftime("%Y-%m-%d", local), local.tm_wday))
+
+def _record_transition(conn, order_id, vendor_id, item_name, status, at=None):
+    """Append a lifecycle event and update the learned estimates and rollups; caller commits."""
+    at = time.time() if at is None else at
+    conn.execute("INSERT INTO order_events (order_id, vendor_id, status, at) VALUES (?, ?, ?, ?)",
+                 (order_id, vendor_id, status, at))
+    if status == "Received":
+        _rollup(conn, vendor_id, at, orders=1)
+    elif status == "Collected":
+        _rollup(conn, vendor_id, at, collected=1)
+    elif status == "Expired":
+        _rollup(conn, vendor_id, at, expired=1)
+    if status != "Ready":
+        return
+    seen = {r["status"]: r["at"] for r in conn.execute(
+        """SELECT status, at FROM order_events WHERE order_id = ? AND status IN ('Received', 'Cooking')
+           ORDER BY id""", (order_id,))}
+    if "Cooking" in seen:
+        _ewma_update(conn, vendor_id, item_name, "prep", (at - seen["Cooking"]) / 60, at)
+    if "Received" in seen:
+        _rollup(conn, vendor_id, at, wait=(at - seen["Received"]) / 60)
+    # Service time: gap between consecutive completions while the kitchen is busy
+    last = conn.execute("""SELECT last_at FROM prep_estimates
+                           WHERE vendor_id = ? AND item_name = '' AND metric = 'service'""", (vendor_id,)).fetchone()
+    gap = (at - last["last_at"]) / 60 if last and last["last_at"] is not None else None
+    if gap is not None and 0 <= gap <= SERVICE_GAP_CAP_MIN:
+        _ewma_update(conn, vendor_id, "", "service", gap, at)
+    else:
+        conn.execute("""INSERT INTO prep_estimates (vendor_id, item_name, metric, last_at) VALUES (?, '', 'service', ?)
+                        ON CONFLICT (vendor_id, item_name, metric) DO UPDATE SET last_at = excluded.last_at""",
+                     (vendor_id, at))
+
+def get_demand_histogram(vendor_id):
+    """Raw demand histogram for a vendor: ([(weekday, bucket, orders)], {weekday: trading days seen})."""
+    with get_db(vendor_id) as conn:
+        cells = [tuple(r) for r in conn.execute(
+            "SELECT weekday, bucket, orders FROM demand_histogram WHERE vendor_id = ?", (vendor_id,))]
+        days = {r["weekday"]: r["n"] for r in conn.execute("SELECT weekday, COUNT(*) AS n FROM demand_days GROUP BY weekday")}
+        return cells, days
+
+def get_order_events(order_id):
+    try:
+        shard = _order_shard(order_id)
+    except UnknownShardError:
+        return []
+    with get_db(shard) as conn:
+        rows = conn.execute("SELECT status, at FROM order_events WHERE order_id = ? ORDER BY id", (order_id,)).fetchall()
+        return [dict(r) for r in rows]
+
+def get_prep_estimates(vendor_id):
+    """
+    Learned estimates for a vendor: {(item_name, metric): {"n", "mean", "var"}};
+    item_name '' is vendor-wide. Read-only mappings, shared across sessions.
+    """
+    def load():
+        with get_db(vendor_id) as conn:
+            rows = conn.execute("SELECT item_name, metric, n, mean, var FROM prep_estimates WHERE vendor_id = ? AND n > 0",
+                                (vendor_id,)).fetchall()
+            return MappingProxyType({(r["item_name"], r["metric"]): MappingProxyType({"n": r["n"], "mean": r["mean"], "var": r["var"]})
+                                     for r in rows})
+    return _coalesced.read(("prep_estimates", vendor_id), load)
+
+# --- ADMIN: KEYSET PAGINATION & ROLLUPS ---
+
+def get_users_page(after_roll=None, limit=50):
+    """Users ordered by roll_no, starting after `after_roll` (keyset pagination)."""
+    with get_db() as conn:
+        rows = conn.execute("""SELECT roll_no, name, points FROM users WHERE roll_no > ?
+                               ORDER BY roll_no LIMIT ?""", ("" if after_roll is None else after_roll, limit)).fetchall()
+        return [dict(r) for r in rows]
+
+def get_orders_page(before_id=None, limit=50):
+    """
+    Newest orders first, starting below order id `before_id` (keyset
+    pagination). When SHARDED each shard's page is merged; ids then sort by
+    vendor before time, since each vendor has its own id range.
+    """
+    query = "SELECT * FROM orders" + (" WHERE id < ?" if before_id is not None else "") + " ORDER BY id DESC LIMIT ?"
+    params = (before_id, limit) if before_id is not None else (limit,)
+    return _merged(_fan_out(lambda conn: conn.execute(query, params).fetchall()), key=lambda r: r["id"], limit=limit)
+
+def get_hourly_rollup(since_hour):
+    """Rollup rows from `since_hour` ('YYYY-MM-DD HH:00') onward, joined with vendor names."""
+    parts = _fan_out(lambda conn: conn.execute("""SELECT r.hour, r.vendor_id, v.name as vendor_name, r.orders, r.collected, r.expired,
+                                                         CASE WHEN r.wait_count > 0 THEN r.wait_total / r.wait_count END as avg_wait
+                                                  FROM order_rollup_hourly r JOIN vendors v ON v.id = r.vendor_id
+                                                  WHERE r.hour >= ? ORDER BY r.hour, r.vendor_id""", (since_hour,)).fetchall())
+    return sorted((dict(r) for part in parts for r in part), key=lambda r: (r["hour"], r["vendor_id"]))
+
+def get_vendor_rollup_totals(since_hour):
+    """Per-vendor totals (orders, no-shows, average wait) summed from the hourly rollup."""
+    def read(conn):
+        return conn.execute("""SELECT v.id as vendor_id, v.name as vendor_name,
+                                      COALESCE(SUM(r.orders), 0) as orders,
+                                      COALESCE(SUM(r.collected), 0) as collected,
+                                      COALESCE(SUM(r.expired), 0) as no_shows,
+                                      SUM(r.wait_total) / NULLIF(SUM(r.wait_count), 0) as avg_wait
+                               FROM vendors v LEFT JOIN order_rollup_hourly r ON r.vendor_id = v.id AND r.hour >= ?
+                               GROUP BY v.id ORDER BY v.id""", (since_hour,)).fetchall()
+    if not SHARDED:
+        return [dict(r) for r in _fan_out(read)[0]]
+    # A shard only holds its own vendor's rollups, so each vendor's row comes from its shard
+    shards = _shard_ids()
+    return [dict(r) for shard, rows in zip(shards, _fan_out(read, shards)) for r in rows if r["vendor_id"] == shard]
+
+# --- ARCHIVAL & COMPACTION ---
+
+def _archive_batches(conn, days, batch, max_batches):
+    cols = ", ".join(ORDER_COLUMNS)
+    moved = batches = 0
+    while max_batches is None or batches < max_batches:
+        conn.execute("BEGIN IMMEDIATE")
+        ids = [r[0] for r in conn.execute("""SELECT id FROM orders
+                                             WHERE status IN ('Collected', 'Expired') AND order_time < datetime('now', ?)
+                                             ORDER BY order_time LIMIT ?""", (f"-{days} days", batch))]
+        if not ids:
+            conn.rollback()
+            break
+        marks = ", ".join("?" for _ in ids)
+        conn.execute(f"INSERT OR REPLACE INTO orders_archive ({cols}) SELECT {cols} FROM orders WHERE id IN ({marks})", ids)
+        conn.execute(f"DELETE FROM orders WHERE id IN ({marks})", ids)
+        conn.commit()
+        moved += len(ids)
+        batches += 1
+    return moved
+
+def archive_finished_orders(older_than_days=None, batch_size=None, max_batches=None):
+    """
+    Move Collected/Expired orders older than `older_than_days` into orders_archive.
+    Works in batches of `batch_size`, each its own short transaction, so live
+    writers are only ever blocked briefly. Returns the number of rows moved.
+    """
+    days = ARCHIVE_AFTER_DAYS if older_than_days is None else older_than_days
+    batch = batch_size or ARCHIVE_BATCH_SIZE
+    return sum(_fan_out(lambda conn: _archive_batches(conn, days, batch, max_batches)))
+
+def _compact(conn, pages):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    else:
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages or VACUUM_PAGES)})").fetchall()
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+def compact_db(pages=None):
+    """
+    Return free pages to the OS (from the shared file and every shard when
+    SHARDED); returns the free pages left. The first call on a file switches
+    it to incremental auto-vacuum (one full VACUUM).
+    """
+    if not SHARDED:
+        with get_db() as conn:
+            return _compact(conn, pages)
+    # Plain connections: VACUUM can't rebuild a shard's indexes under the TEMP catalog views
+    free = 0
+    for path in [DB_FILE] + [shard_file(v) for v in _shard_ids()]:
+        conn = connect(path)
+        try:
+            free += _compact(conn, pages)
+        finally:
+            conn.close()
+    return free
+
+def get_order_history(user_id=None, vendor_id=None, since=None, limit=100):
+    """Orders across live and archived storage, newest first; `since` is a 'YYYY-MM-DD[ HH:MM:SS]' UTC string."""
+    clauses, params = [], []
+    if user_id is not None:
+        clauses.append("user_id = ?"); params.append(user_id.strip())
+    if vendor_id is not None:
+        clauses.append("vendor_id = ?"); params.append(vendor_id)
+    if since is not None:
+        clauses.append("order_time >= ?"); params.append(since)
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    parts = _fan_out(lambda conn: conn.execute(f"SELECT * FROM orders_all{where} ORDER BY order_time DESC, id DESC LIMIT ?",
+                                               (*params, limit)).fetchall(),
+                     shards=None if vendor_id is None else [vendor_id])
+    return _merged(parts, key=lambda r: (r["order_time"], r["id"]), limit=limit)
+
+def get_order(order_id):
+    """One order by id from live or archived storage, or None."""
+    try:
+        shard = _order_shard(order_id)
+    except UnknownShardError:
+        return None
+    with get_db(shard) as conn:
+        row = conn.execute("SELECT * FROM orders_all WHERE id = ?", (order_id,)).fetchone()
+        return dict(row) if row else None
+
+_archiver = None
+
+def start_archiver(interval=None):
+    """Run archive_finished_orders + compact_db on a daemon thread every `interval` seconds (once per process)."""
+    global _archiver
+    with _pool_lock:
+        if _archiver is not None and _archiver.is_alive():
+            return _archiver
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(ARCHIVE_INTERVAL if interval is None else interval):
+                try:
+                    if archive_finished_orders():
+                        compact_db()
+                except sqlite3.Error:
+                    pass  # try again next interval
+
+        _archiver = threading.Thread(target=loop, name="canteen-archiver", daemon=True)
+        _archiver.stop = stop
+        _archiver.start()
+        atexit.register(stop.set)
+        return _archiver
+
+# --- NO-SHOW SWEEPER ---
+
+def _sweep_no_shows(conn, threshold_min, at, dock=True):
+    # The UPDATE picks and expires overdue orders in one statement (RETURNING
+    # needs SQLite 3.35+). Ready time comes from the lifecycle log, falling
+    # back to order_time for orders that predate it.
+    rows = conn.execute("""UPDATE orders SET status = 'Expired'
+                           WHERE status = 'Ready'
+                             AND COALESCE((SELECT MAX(e.at) FROM order_events e
+                                           WHERE e.order_id = orders.id AND e.status = 'Ready'),
+                                          CAST(strftime('%s', order_time) AS INTEGER)) <= ?
+                           RETURNING id, user_id, vendor_id""", (at - threshold_min * 60,)).fetchall()
+    points = _apply_expiry(conn, rows, at, dock)
+    if rows:
+        conn.execute("""INSERT INTO no_show_sweeps (at, threshold_min, expired, users_penalized, order_ids)
+                        VALUES (?, ?, ?, ?, ?)""",
+                     (at, threshold_min, len(rows), len(points), json.dumps(sorted(r["id"] for r in rows))))
+    return len(rows), {r["vendor_id"] for r in rows}, points
+
+def sweep_no_shows(threshold_min=None):
+    """
+    Expire every order left Ready for more than `threshold_min` minutes and
+    dock NO_SHOW_PENALTY karma per order, all in one transaction. Sweeps that
+    expire anything are logged in no_show_sweeps. When SHARDED each shard is
+    swept in its own transaction and the karma for all of them is docked in
+    one more on the shared file. Returns the number expired.
+    """
+    threshold = NO_SHOW_AFTER_MIN if threshold_min is None else threshold_min
+    at = time.time()
+    if not SHARDED:
+        expired, vendors, points = _write(_sweep_no_shows, threshold, at)
+    else:
+        expired, vendors, no_shows = 0, set(), {}
+        for shard in _shard_ids():
+            n, swept, per_user = _write(_sweep_no_shows, threshold, at, False, shard=shard)
+            expired += n
+            vendors |= swept
+            for uid, count in per_user.items():
+                no_shows[uid] = no_shows.get(uid, 0) + count
+        points = _write(_dock_no_shows, no_shows)
+    for uid, pts in points.items():
+        _profiles.set_points(uid, pts)
+    for vendor_id in vendors:
+        _coalesced.invalidate(vendor_id)
+    return expired
+
+def get_sweep_log(limit=20):
+    parts = _fan_out(lambda conn: conn.execute("SELECT * FROM no_show_sweeps ORDER BY id DESC LIMIT ?", (limit,)).fetchall())
+    return _merged(parts, key=lambda r: (r["at"], r["id"]), limit=limit)
+
+_sweeper = None
+
+def start_sweeper(interval=None, threshold_min=None):
+    """Run sweep_no_shows on a daemon thread every `interval` seconds (once per process)."""
+    global _sweeper
+    with _pool_lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return _sweeper
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(SWEEP_INTERVAL if interval is None else interval):
+                try:
+                    sweep_no_shows(threshold_min)
+                except sqlite3.Error:
+                    pass  # try again next interval
+
+        _sweeper = threading.Thread(target=loop, name="canteen-sweeper", daemon=True)
+        _sweeper.stop = stop
+        _sweeper.start()
+        atexit.register(stop.set)
+        return _sweeper
+
+# --- INSTRUMENTATION ---
+# Every public helper above is timed into metrics' "db" series
+metrics.instrument_module(globals(), "db", exclude={"connect", "connect_shard", "get_db", "close_pool", "stop_writer",
+                                                    "start_archiver", "start_sweeper"})
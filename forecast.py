@@ -0,0 +1,91 @@
+"""
+Canteen Rush AI - Demand Forecasting
+Per-vendor arrival-rate forecasts from weekday x time-of-day demand histograms.
+
+database.py keeps a histogram of orders per (vendor, local weekday,
+DEMAND_BUCKET_MIN bucket) that is bumped as orders are placed, plus the
+number of trading days seen per weekday. The expected number of orders
+in a bucket is simply orders / days for that weekday. Profiles are
+loaded into a (7, buckets_per_day) NumPy array and cached for
+PROFILE_TTL seconds, so forecasting the next few hours is a single
+fancy-index into that array.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import database as db
+
+PROFILE_TTL = 60             # seconds a loaded profile is reused
+HORIZON_HOURS = 3            # default forecast length
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def _buckets_per_day():
+    return 24 * 60 // db.DEMAND_BUCKET_MIN
+
+
+def profile(vendor_id: int) -> np.ndarray:
+    """Expected orders per bucket, shape (7, buckets_per_day), indexed [weekday (Mon = 0), bucket]."""
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(vendor_id)
+        if entry is not None and now - entry[0] < PROFILE_TTL:
+            return entry[1]
+    cells, days = db.get_demand_histogram(vendor_id)
+    counts = np.zeros((7, _buckets_per_day()))
+    if cells:
+        wd, bucket, orders = np.array(cells, dtype=np.int64).T
+        np.add.at(counts, (wd, bucket), orders)
+    n_days = np.array([days.get(w, 0) for w in range(7)], dtype=float)
+    rates = np.divide(counts, n_days[:, None], out=np.zeros_like(counts), where=n_days[:, None] > 0)
+    with _lock:
+        _cache[vendor_id] = (now, rates)
+    return rates
+
+
+def forecast(vendor_id: int, now: datetime = None, hours: float = HORIZON_HOURS) -> dict:
+    """
+    Expected orders per bucket for the next `hours`, starting with the
+    bucket that contains `now`. Returns {"start": datetime of the first
+    bucket, "bucket_minutes", "times": [datetime per bucket], "orders":
+    np.ndarray}.
+    """
+    now = now or datetime.now()
+    width = db.DEMAND_BUCKET_MIN
+    per_day = _buckets_per_day()
+    start = now.replace(minute=now.minute - now.minute % width, second=0, microsecond=0)
+    steps = np.arange(int(np.ceil(hours * 60 / width)))
+    absolute = now.weekday() * per_day + (start.hour * 60 + start.minute) // width + steps
+    weekday, bucket = (absolute // per_day) % 7, absolute % per_day
+    return {
+        "start": start,
+        "bucket_minutes": width,
+        "times": [start + timedelta(minutes=int(k) * width) for k in steps],
+        "orders": profile(vendor_id)[weekday, bucket],
+    }
+
+
+def expected_arrivals(vendor_id: int, now: datetime = None, minutes: float = 15) -> float:
+    """Expected orders between `now` and `now + minutes` (partial buckets prorated)."""
+    now = now or datetime.now()
+    width = db.DEMAND_BUCKET_MIN
+    f = forecast(vendor_id, now, (minutes + width) / 60)
+    # Overlap of [now, now + minutes) with each bucket, in minutes
+    offset = (now - f["start"]).total_seconds() / 60
+    edges = np.arange(f["orders"].size + 1) * width
+    overlap = np.clip(np.minimum(edges[1:], offset + minutes) - np.maximum(edges[:-1], offset), 0, width)
+    return float((f["orders"] * overlap / width).sum())
+
+
+def invalidate(vendor_id: int = None):
+    with _lock:
+        if vendor_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(vendor_id, None)
@@ -0,0 +1,253 @@
+"""
+Canteen Rush AI - Local Image Cache
+Thumbnails for vendor/menu images and token QR codes, stored on local disk.
+
+Images are fetched (or imported from a local path) once, resized to
+THUMB_SIZE and written under CACHE_DIR, named by the SHA-256 of the
+thumbnail bytes. A small ref file maps each source (URL, path, or QR
+token) to its blob. Streamlit serves CACHE_DIR as static files
+(server.enableStaticServing in .streamlit/config.toml), so pages link to
+small local files instead of remote originals. Lookups never block on the
+network: a missing image gets a locally drawn placeholder while a
+background thread fetches it.
+
+    python images.py            # import every catalog image now (e.g. before going offline)
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import queue
+import threading
+import time
+import urllib.request
+
+from PIL import Image, ImageDraw
+
+try:
+    import qrcode
+except ImportError:  # fall back to a plain token tile
+    qrcode = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "static", "cache")
+STATIC_URL = "app/static/cache"      # where Streamlit serves CACHE_DIR
+THUMB_SIZE = (400, 300)              # cards show ~150-180px tall; 2x for hi-dpi screens
+JPEG_QUALITY = 80
+MAX_CACHE_BYTES = 64 * 1024 * 1024   # oldest blobs are evicted past this
+MAX_SOURCE_BYTES = 10 * 1024 * 1024  # refuse larger downloads
+FETCH_TIMEOUT = 5.0
+RETRY_AFTER = 300.0                  # seconds before refetching a source that failed (e.g. offline)
+QR_SIZE = 160
+
+_lock = threading.Lock()
+_refs = {}             # source key -> blob name (in-memory copy of CACHE_DIR/refs)
+_pending = set()       # sources queued for background fetch
+_failed = {}           # source -> monotonic time of the last failed fetch
+_cache_bytes = None    # running total of blob sizes, computed on first write
+_queue = queue.Queue()
+_worker = None
+
+
+def _key(source):
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _ref_path(key):
+    return os.path.join(CACHE_DIR, "refs", key)
+
+
+def _lookup(source):
+    """Blob name for a source if it is cached on disk, else None."""
+    key = _key(source)
+    with _lock:
+        name = _refs.get(key)
+    if name is not None:
+        return name
+    try:
+        with open(_ref_path(key)) as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    if not os.path.exists(os.path.join(CACHE_DIR, name)):
+        return None
+    with _lock:
+        _refs[key] = name
+    return name
+
+
+def _store(source, data, ext):
+    """Write blob bytes under their content hash and point `source` at them."""
+    global _cache_bytes
+    name = f"{hashlib.sha256(data).hexdigest()}.{ext}"
+    path = os.path.join(CACHE_DIR, name)
+    os.makedirs(os.path.join(CACHE_DIR, "refs"), exist_ok=True)
+    if not os.path.exists(path):
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with _lock:
+            if _cache_bytes is not None:
+                _cache_bytes += len(data)
+    key = _key(source)
+    tmp = f"{_ref_path(key)}.{threading.get_ident()}.tmp"
+    with open(tmp, "w") as f:
+        f.write(name)
+    os.replace(tmp, _ref_path(key))
+    with _lock:
+        _refs[key] = name
+    _enforce_limit(keep=name)
+    return name
+
+
+def _enforce_limit(keep=None):
+    """Evict the oldest blobs until the cache fits MAX_CACHE_BYTES."""
+    global _cache_bytes
+    with _lock:
+        if _cache_bytes is not None and _cache_bytes <= MAX_CACHE_BYTES:
+            return
+        blobs = []
+        for entry in os.scandir(CACHE_DIR):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                st = entry.stat()
+                blobs.append((st.st_mtime, st.st_size, entry.name))
+        _cache_bytes = sum(size for _, size, _ in blobs)
+        for _, size, name in sorted(blobs):
+            if _cache_bytes <= MAX_CACHE_BYTES:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+                _cache_bytes -= size
+            except OSError:
+                pass
+        # Refs to evicted blobs are detected (and refetched) on the next lookup
+        _refs.clear()
+
+
+def _read_source(source):
+    if source.startswith(("http://", "https://")):
+        req = urllib.request.Request(source, headers={"User-Agent": "canteen-rush-image-cache"})
+        with urllib.request.urlopen(req, timeout=FETCH_TIMEOUT) as resp:
+            data = resp.read(MAX_SOURCE_BYTES + 1)
+    else:
+        with open(source, "rb") as f:
+            data = f.read(MAX_SOURCE_BYTES + 1)
+    if len(data) > MAX_SOURCE_BYTES:
+        raise ValueError(f"image larger than {MAX_SOURCE_BYTES} bytes: {source}")
+    return data
+
+
+def import_image(source):
+    """Fetch or read `source`, store a JPEG thumbnail and return its blob name (blocking)."""
+    img = Image.open(io.BytesIO(_read_source(source)))
+    img = img.convert("RGB")
+    img.thumbnail(THUMB_SIZE)
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return _store(source, out.getvalue(), "jpg")
+
+
+def _run_worker():
+    while True:
+        source = _queue.get()
+        try:
+            import_image(source)
+        except Exception:
+            # Stays on the placeholder; retried once RETRY_AFTER has passed
+            with _lock:
+                _failed[source] = time.monotonic()
+        finally:
+            with _lock:
+                _pending.discard(source)
+
+
+def prefetch(sources):
+    """Queue uncached sources for the background fetcher."""
+    global _worker
+    for source in sources:
+        if not source or _lookup(source) is not None:
+            continue
+        with _lock:
+            failed_at = _failed.get(source)
+            if source in _pending or (failed_at is not None and time.monotonic() - failed_at < RETRY_AFTER):
+                continue
+            _pending.add(source)
+            if _worker is None:
+                _worker = threading.Thread(target=_run_worker, name="canteen-images", daemon=True)
+                _worker.start()
+        _queue.put(source)
+
+
+def _url(name):
+    return f"{STATIC_URL}/{name}"
+
+
+def placeholder_url(label):
+    """A locally drawn tile with the label's initials, colored from its hash."""
+    source = f"placeholder:{label}"
+    name = _lookup(source)
+    if name is None:
+        digest = hashlib.sha256(label.encode("utf-8")).digest()
+        img = Image.new("RGB", THUMB_SIZE, (40 + digest[0] % 120, 40 + digest[1] % 120, 40 + digest[2] % 120))
+        initials = "".join(w[0] for w in label.split()[:2]).upper() or "?"
+        draw = ImageDraw.Draw(img)
+        draw.text((THUMB_SIZE[0] / 2, THUMB_SIZE[1] / 2), initials, fill=(255, 255, 255), anchor="mm",
+                  font_size=THUMB_SIZE[1] // 3)
+        out = io.BytesIO()
+        img.save(out, "PNG", optimize=True)
+        name = _store(source, out.getvalue(), "png")
+    return _url(name)
+
+
+def thumbnail_url(source, label=""):
+    """Static URL of the cached thumbnail for `source`; a placeholder (and a background fetch) if not cached yet."""
+    name = _lookup(source) if source else None
+    if name is not None:
+        return _url(name)
+    if source:
+        prefetch([source])
+    return placeholder_url(label)
+
+
+def token_qr_url(token):
+    """Static URL of a locally generated QR code for an order token."""
+    source = f"qr:{token}"
+    name = _lookup(source)
+    if name is None:
+        if qrcode is not None:
+            img = qrcode.make(token, border=2).get_image().convert("L")
+        else:
+            img = Image.new("L", (QR_SIZE, QR_SIZE), 255)
+            ImageDraw.Draw(img).text((QR_SIZE / 2, QR_SIZE / 2), token, fill=0, anchor="mm", font_size=QR_SIZE // 6)
+        img = img.resize((QR_SIZE, QR_SIZE), Image.NEAREST)
+        out = io.BytesIO()
+        img.save(out, "PNG", optimize=True)
+        name = _store(source, out.getvalue(), "png")
+    return _url(name)
+
+
+def main():
+    import database as db
+    parser = argparse.ArgumentParser(description="Import every vendor and menu image into the local cache.")
+    parser.add_argument("--db", default=db.DB_FILE)
+    args = parser.parse_args()
+    db.DB_FILE = args.db
+    db.init_db()
+    sources = [v["image_url"] for v in db.get_all_vendors()]
+    sources += [m["image_url"] for v in db.get_all_vendors() for m in db.get_menu(v["id"], active_only=False)]
+    ok = 0
+    for source in filter(None, sources):
+        try:
+            import_image(source)
+            ok += 1
+        except Exception as e:
+            print(f"failed: {source} ({e})")
+    print(f"cached {ok}/{len(sources)} images in {CACHE_DIR}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Canteen Rush AI - Instrumentation
+Always-on, low-overhead timing for SQL queries, helper functions and page renders.
+
+- Queries: database.connect() opens connections with InstrumentedConnection,
+  whose cursors time each statement from execute() until its rows are
+  consumed and count the rows. A SQLite progress handler counts VM steps
+  per statement as a measure of work done inside the engine.
+- Helpers: instrument_module() wraps a module's public functions in place.
+- Renders: `with metrics.timed("render", "student"):`.
+
+Every series keeps lifetime Prometheus-style histogram buckets plus a
+rolling WINDOW_SECONDS window for the admin Performance tab. The slowest
+statements are kept as samples with their SQL. start_exporter() writes
+metrics.prom (Prometheus text format) and metrics.json for local scraping.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+ENABLED = True
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+WINDOW_SECONDS = 300         # rolling window shown in the admin tab
+SLOT_SECONDS = 10            # rolling window granularity
+SLOW_QUERY_MS = 50           # statements slower than this are sampled with their SQL
+SLOW_SAMPLES = 50            # most recent slow samples kept
+MAX_SERIES = 500             # distinct series per kind (extra SQL shapes fold into "other")
+PROGRESS_STEPS = 1000        # VM instructions between progress-handler ticks
+EXPORT_INTERVAL = 15         # seconds between metrics file writes
+EXPORT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")  # + .prom / .json
+
+
+class RollingHistogram:
+    """Lifetime histogram buckets plus per-slot buckets for a rolling window."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.rows = 0
+        self.steps = 0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.slots = {}   # slot index -> [bucket counts..., total_ms, count]
+
+    def observe(self, ms, rows=0, steps=0, now=None):
+        i = next((k for k, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))
+        self.count += 1
+        self.total_ms += ms
+        self.rows += rows
+        self.steps += steps
+        self.buckets[i] += 1
+        slot = int((now or time.time()) // SLOT_SECONDS)
+        counts = self.slots.get(slot)
+        if counts is None:
+            # New slot: drop the ones that have left the window
+            oldest = slot - WINDOW_SECONDS // SLOT_SECONDS
+            for old in [s for s in self.slots if s <= oldest]:
+                del self.slots[old]
+            counts = self.slots[slot] = [0] * (len(BUCKETS_MS) + 3)
+        counts[i] += 1
+        counts[-2] += ms
+        counts[-1] += 1
+
+    def window(self, now=None):
+        """{count, mean_ms, p50_ms, p95_ms, p99_ms} over the rolling window (percentiles are bucket upper bounds)."""
+        oldest = int((now or time.time()) // SLOT_SECONDS) - WINDOW_SECONDS // SLOT_SECONDS
+        merged = [0] * (len(BUCKETS_MS) + 3)
+        for slot, counts in self.slots.items():
+            if slot > oldest:
+                merged = [a + b for a, b in zip(merged, counts)]
+        n = merged[-1]
+        out = {"count": n, "mean_ms": merged[-2] / n if n else None}
+        for q in (50, 95, 99):
+            out[f"p{q}_ms"] = _bucket_quantile(merged[:-2], n, q) if n else None
+        return out
+
+
+def _bucket_quantile(counts, n, q):
+    target, seen = q / 100 * n, 0
+    for k, c in enumerate(counts):
+        seen += c
+        if seen >= target:
+            return BUCKETS_MS[k] if k < len(BUCKETS_MS) else float("inf")
+    return float("inf")
+
+
+_lock = threading.Lock()
+_series = {}                          # (kind, name) -> RollingHistogram
+_slow = deque(maxlen=SLOW_SAMPLES)    # {"at", "ms", "rows", "steps", "sql"}
+
+
+def observe(kind, name, ms, rows=0, steps=0):
+    with _lock:
+        key = (kind, name)
+        hist = _series.get(key)
+        if hist is None:
+            if sum(1 for k, _ in _series if k == kind) >= MAX_SERIES:
+                key = (kind, "other")
+                hist = _series.get(key)
+            if hist is None:
+                hist = _series[key] = RollingHistogram()
+        hist.observe(ms, rows, steps)
+
+
+@contextmanager
+def timed(kind, name):
+    """Time a block into the (kind, name) series."""
+    if not ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(kind, name, (time.perf_counter() - start) * 1000)
+
+
+def instrument_module(namespace, kind, exclude=()):
+    """Replace every public function defined in `namespace` (a module's globals()) with a timed wrapper."""
+    module = namespace["__name__"]
+    for name, fn in list(namespace.items()):
+        if (name.startswith("_") or name in exclude or not inspect.isfunction(fn)
+                or fn.__module__ != module or getattr(fn, "__wrapped__", None)):
+            continue
+        namespace[name] = _wrap(fn, kind, name)
+
+
+def _wrap(fn, kind, name):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not ENABLED:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe(kind, name, (time.perf_counter() - start) * 1000)
+    return wrapper
+
+
+# --- SQL INSTRUMENTATION ---
+
+_WS = re.compile(r"\s+")
+
+
+def _normalize(sql):
+    return _WS.sub(" ", sql).strip()[:200]
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Times each statement from execute() until its rows are consumed (or the
+    next execute/close), counting rows fetched or modified.
+    """
+
+    _sql = None
+
+    def _begin(self, sql):
+        self._finish()
+        self._sql, self._rows, self._elapsed = sql, 0, 0.0
+        self.connection._steps = 0
+
+    def _finish(self, exhausted=False):
+        if self._sql is None:
+            return
+        sql, self._sql = self._sql, None
+        rows = self._rows if self._rows or self.rowcount < 0 else self.rowcount
+        steps = getattr(self.connection, "_steps", 0) * PROGRESS_STEPS
+        ms = self._elapsed * 1000
+        key = _normalize(sql)
+        observe("query", key, ms, rows, steps)
+        if ms >= SLOW_QUERY_MS:
+            with _lock:
+                _slow.append({"at": time.time(), "ms": round(ms, 3), "rows": rows, "steps": steps, "sql": key})
+
+    def _timed(self, call, *args):
+        start = time.perf_counter()
+        try:
+            return call(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        if not ENABLED:
+            return super().execute(sql, parameters)
+        self._begin(sql)
+        self._timed(super().execute, sql, parameters)
+        if self.description is None:
+            self._finish()  # DML/DDL: nothing left to fetch
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        if not ENABLED:
+            return super().executemany(sql, seq_of_parameters)
+        self._begin(sql)
+        self._timed(super().executemany, sql, seq_of_parameters)
+        self._finish()
+        return self
+
+    def fetchone(self):
+        if self._sql is None:
+            return super().fetchone()
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        if self._sql is None:
+            return super().fetchmany(size if size is not None else self.arraysize)
+        rows = self._timed(super().fetchmany, size if size is not None else self.arraysize)
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        if self._sql is None:
+            return super().fetchall()
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        if self._sql is None:
+            return super().__next__()
+        try:
+            row = self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        # Partially consumed cursors (e.g. a single fetchone) are recorded when dropped
+        try:
+            self._finish()
+        except Exception:
+            pass
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Connection whose cursors are InstrumentedCursor and whose VM work is counted by a progress handler."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._steps = 0
+        if ENABLED:
+            self.set_progress_handler(self._tick, PROGRESS_STEPS)
+
+    def _tick(self):
+        self._steps += 1
+        return 0
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# --- EXPORT ---
+
+def snapshot(kind=None):
+    """{kind: {name: {...lifetime totals, "window": rolling stats}}} plus recent slow queries."""
+    now = time.time()
+    with _lock:
+        out = {}
+        for (k, name), hist in _series.items():
+            if kind is not None and k != kind:
+                continue
+            out.setdefault(k, {})[name] = {
+                "count": hist.count,
+                "total_ms": hist.total_ms,
+                "rows": hist.rows,
+                "vm_steps": hist.steps,
+                "window": hist.window(now),
+            }
+        return {"at": now, "window_seconds": WINDOW_SECONDS, "series": out, "slow_queries": list(_slow)}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def render_prometheus():
+    """Lifetime histograms in Prometheus text exposition format."""
+    lines = [
+        "# HELP canteen_duration_ms Latency of queries, helpers and page renders in milliseconds.",
+        "# TYPE canteen_duration_ms histogram",
+    ]
+    extra = {"rows": [], "steps": []}
+    with _lock:
+        for (kind, name), hist in sorted(_series.items()):
+            labels = f'kind="{_label(kind)}",name="{_label(name)}"'
+            seen = 0
+            for bound, c in zip(BUCKETS_MS, hist.buckets):
+                seen += c
+                lines.append(f'canteen_duration_ms_bucket{{{labels},le="{bound}"}} {seen}')
+            lines.append(f'canteen_duration_ms_bucket{{{labels},le="+Inf"}} {hist.count}')
+            lines.append(f"canteen_duration_ms_sum{{{labels}}} {hist.total_ms:.3f}")
+            lines.append(f"canteen_duration_ms_count{{{labels}}} {hist.count}")
+            if kind == "query":
+                extra["rows"].append(f"canteen_query_rows_total{{{labels}}} {hist.rows}")
+                extra["steps"].append(f"canteen_query_vm_steps_total{{{labels}}} {hist.steps}")
+    lines += ["# HELP canteen_query_rows_total Rows returned or modified per SQL statement.",
+              "# TYPE canteen_query_rows_total counter"] + extra["rows"]
+    lines += ["# HELP canteen_query_vm_steps_total Approximate SQLite VM instructions per SQL statement.",
+              "# TYPE canteen_query_vm_steps_total counter"] + extra["steps"]
+    return "\n".join(lines) + "\n"
+
+
+def write_files(path=None):
+    """Write <path>.prom and <path>.json atomically."""
+    path = path or EXPORT_PATH
+    for ext, text in ((".prom", render_prometheus()), (".json", json.dumps(snapshot(), indent=1))):
+        tmp = f"{path}{ext}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path + ext)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def start_exporter(interval=None, path=None):
+    """Write the metrics files every `interval` seconds on a daemon thread (once per process)."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is not None and _exporter.is_alive():
+            return _exporter
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(EXPORT_INTERVAL if interval is None else interval):
+                try:
+                    write_files(path)
+                except OSError:
+                    pass  # try again next interval
+
+        _exporter = threading.Thread(target=loop, name="canteen-metrics", daemon=True)
+        _exporter.stop = stop
+        _exporter.start()
+        atexit.register(stop.set)
+        return _exporter
+
+
+def reset():
+    with _lock:
+        _series.clear()
+        _slow.clear()
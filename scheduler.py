@@ -0,0 +1,134 @@
+"""
+Canteen Rush AI - Capacity-Aware Slot Scheduler
+Per-vendor kitchen capacity in fixed time slots with O(log n) earliest-fit search.
+
+Time is cut into SLOT_MINUTES windows (indexed by epoch minute // SLOT_MINUTES).
+Each window can complete `capacity` orders for a vendor. Reservations live
+in SQLite (slot_reservations) and are claimed with a conditional UPDATE
+inside the order transaction. This module keeps an in-process segment tree
+of the remaining capacity per window, so finding the earliest window at or
+after a requested time is a tree descent instead of a scan.
+"""
+
+import math
+import threading
+from datetime import datetime
+
+import database as db
+
+SLOT_MINUTES = 5
+SLOTS_PER_BLOCK = 24 * 60 // SLOT_MINUTES   # one tree per vendor per 24h block
+SEARCH_BLOCKS = 2                           # how far ahead to look for room
+
+
+class SlotTree:
+    """Max segment tree over remaining capacity per slot."""
+
+    def __init__(self, n, capacity):
+        size = 1
+        while size < n:
+            size *= 2
+        self.n, self.size = n, size
+        self.tree = [0] * (2 * size)
+        for i in range(n):
+            self.tree[size + i] = capacity
+        for i in range(size - 1, 0, -1):
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+
+    def get(self, i):
+        return self.tree[self.size + i]
+
+    def set(self, i, value):
+        i += self.size
+        self.tree[i] = value
+        i //= 2
+        while i:
+            self.tree[i] = max(self.tree[2 * i], self.tree[2 * i + 1])
+            i //= 2
+
+    def first_free(self, lo):
+        """Smallest slot index >= lo with remaining capacity, or None."""
+        return self._find(1, 0, self.size, lo)
+
+    def _find(self, node, left, right, lo):
+        if right <= lo or self.tree[node] <= 0:
+            return None
+        if right - left == 1:
+            return left if left < self.n else None
+        mid = (left + right) // 2
+        found = self._find(2 * node, left, mid, lo)
+        return found if found is not None else self._find(2 * node + 1, mid, right, lo)
+
+
+def slot_of(dt: datetime) -> int:
+    return int(dt.timestamp() // 60) // SLOT_MINUTES
+
+
+def slot_start(slot: int) -> datetime:
+    return datetime.fromtimestamp(slot * SLOT_MINUTES * 60)
+
+
+def slot_capacity(service_minutes: float) -> int:
+    """Orders a vendor can complete per slot, given its minutes of throughput per order."""
+    return max(1, math.floor(SLOT_MINUTES / max(service_minutes, 0.1)))
+
+
+class SlotScheduler:
+    """Process-wide cache of per-vendor slot trees backed by slot_reservations."""
+
+    def __init__(self):
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def _tree(self, vendor_id, block, capacity):
+        entry = self._trees.get((vendor_id, block))
+        if entry is None or entry[0] != capacity:
+            first = block * SLOTS_PER_BLOCK
+            tree = SlotTree(SLOTS_PER_BLOCK, capacity)
+            for slot, used in db.get_slot_usage(vendor_id, first, first + SLOTS_PER_BLOCK).items():
+                tree.set(slot - first, max(0, capacity - used))
+            entry = (capacity, tree)
+            self._trees[(vendor_id, block)] = entry
+        return entry[1]
+
+    def earliest(self, vendor_id, not_before: datetime, capacity: int, held=None):
+        """
+        Earliest (pickup datetime, slot) with room at or after `not_before`.
+        `held` maps slot -> orders already tentatively placed there by the
+        caller (e.g. earlier items in the same cart).
+        """
+        held = held or {}
+        start = slot_of(not_before)
+        with self._lock:
+            self._prune(start // SLOTS_PER_BLOCK)
+            for block in range(start // SLOTS_PER_BLOCK, start // SLOTS_PER_BLOCK + SEARCH_BLOCKS):
+                tree = self._tree(vendor_id, block, capacity)
+                base = block * SLOTS_PER_BLOCK
+                i = tree.first_free(max(0, start - base))
+                while i is not None and tree.get(i) - held.get(base + i, 0) <= 0:
+                    i = tree.first_free(i + 1)
+                if i is not None:
+                    slot = base + i
+                    return max(not_before, slot_start(slot)), slot
+        # Fully booked for the whole horizon: promise the requested time and don't reserve
+        return not_before, None
+
+    def commit(self, vendor_id, slots, capacity):
+        """Record reservations that were just written to the database."""
+        with self._lock:
+            for slot in slots:
+                block = slot // SLOTS_PER_BLOCK
+                entry = self._trees.get((vendor_id, block))
+                if entry and entry[0] == capacity:
+                    i = slot - block * SLOTS_PER_BLOCK
+                    entry[1].set(i, max(0, entry[1].get(i) - 1))
+
+    def invalidate(self, vendor_id=None):
+        """Drop cached trees (e.g. after another process claimed a slot first)."""
+        with self._lock:
+            for key in [k for k in self._trees if vendor_id is None or k[0] == vendor_id]:
+                del self._trees[key]
+
+    def _prune(self, current_block):
+        for key in [k for k in self._trees if k[1] < current_block]:
+            del self._trees[key]
@@ -0,0 +1,296 @@
+"""
+Canteen Rush AI - Discrete-Event Canteen Simulator
+Headless backtest of ai_engine's pickup predictions under realistic load.
+
+Arrivals are a non-homogeneous Poisson process per vendor: a steady trickle
+through opening hours plus bursts around ai_engine.BREAKS. Some students
+pre-order for the next break. Each kitchen is `servers` cooks who take
+tickets round-robin, with lognormal service times centred on the menu prep
+time. For a fixed dispatch order, every cook is a single FIFO server, so
+completion times follow the Lindley recursion and vectorize to one
+np.maximum.accumulate per cook.
+
+Each order is predicted the way ai_engine.calculate_wait_times would have at
+placement time: the queue it saw, the vendor's learned service time (the
+EWMA database.py keeps of gaps between Ready events, replayed over the
+simulated completions), the rush multiplier with forecast load, the buffer,
+break targeting and the pickup-slot fit for pre-orders. The kitchen then
+starts each pre-order from its promised pickup, as the KDS does.
+
+Left out, so the error figures don't cover them: learned per-item prep
+times (service times are centred on the menu prep, which is what they
+would learn), the forecast's learning (load comes from the true arrival
+rate, i.e. a fully trained demand histogram), multi-vendor carts and
+no-show expiry. Queue lengths and learned service times come from a first
+kitchen run that starts pre-orders at their break, not their fitted slot.
+
+    python simulator.py --days 100 --scale 25 --json sim_report.json   # ~1M orders
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import ai_engine
+import database as db
+import scheduler
+
+# Minutes after midnight
+OPEN_MINUTE = 8 * 60
+CLOSE_MINUTE = 17 * 60
+BREAKS = {label: h * 60 + m for label in ai_engine.BREAKS for h, m in [ai_engine._parse_target_break(label)]}
+MINUTES_PER_DAY = 24 * 60
+
+DEFAULTS = {
+    "base_rate": 0.1,         # orders/minute per vendor outside bursts
+    "burst_rate": 1.0,        # extra orders/minute at the peak of a break
+    "burst_width": 8.0,       # std-dev of the burst around each break (minutes)
+    "preorder_share": 0.2,    # fraction of orders placed for the next break
+    "servers": 4,             # cooks per vendor
+    "service_cv": 0.3,        # coefficient of variation of prep times
+    "collect_delay": 3.0,     # mean minutes a student takes to collect once Ready
+}
+
+# What the backtest measures of ai_engine.calculate_wait_times, written into every report
+ENGINE = {
+    "modelled": ["queue count", "learned service time", "rush multiplier with forecast load", "buffer",
+                 "break targeting", "pickup-slot fit"],
+    "left_out": ["learned per-item prep times", "forecast learning (true arrival rate used)",
+                 "multi-vendor carts", "no-show expiry"],
+}
+
+
+def load_catalog(db_file=None):
+    """Vendor prep times from the catalog: {vendor_id: (name, np.array(prep_minutes))}."""
+    workdir = None
+    if db_file is None:
+        # Fresh seeded catalog, so the real canteen.db is never migrated or written
+        workdir = tempfile.mkdtemp(prefix="canteen-sim-")
+        db_file = os.path.join(workdir, "sim.db")
+    db.DB_FILE = db_file
+    db.init_db()
+    catalog = {}
+    for v in db.get_all_vendors():
+        preps = [m["avg_prep_time"] for m in db.get_menu(v["id"], active_only=False)]
+        if preps:
+            catalog[v["id"]] = (v["name"], np.array(preps, dtype=float))
+    db.close_pool()
+    if workdir:
+        for name in os.listdir(workdir):
+            os.remove(os.path.join(workdir, name))
+        os.rmdir(workdir)
+    return catalog
+
+
+def arrival_rate(params, scale=1.0):
+    """Expected orders per minute for each minute of a day (length MINUTES_PER_DAY)."""
+    minutes = np.arange(MINUTES_PER_DAY) + 0.5
+    lam = np.full(MINUTES_PER_DAY, params["base_rate"])
+    for b in BREAKS.values():
+        lam += params["burst_rate"] * np.exp(-0.5 * ((minutes - b) / params["burst_width"]) ** 2)
+    lam[(minutes < OPEN_MINUTE) | (minutes >= CLOSE_MINUTE)] = 0.0
+    return lam * scale
+
+
+def generate_arrivals(rng, days, lam):
+    """Absolute arrival minutes (sorted) over `days` days for one vendor."""
+    counts = rng.poisson(np.broadcast_to(lam, (days, lam.size))).ravel()
+    minute_index = np.repeat(np.arange(counts.size), counts)
+    return minute_index + rng.random(minute_index.size)
+
+
+def kitchen_finish_times(release, service, servers):
+    """Completion times for tickets served round-robin by `servers` FIFO cooks."""
+    order = np.argsort(release, kind="stable")
+    r, s = release[order], service[order]
+    finish = np.empty_like(r)
+    for k in range(servers):
+        idx = slice(k, None, servers)
+        rk, sk = r[idx], s[idx]
+        # Lindley: f_i = max(r_i, f_{i-1}) + s_i  ==  S_i + max_{j<=i}(r_j - S_{j-1})
+        cum = np.cumsum(sk)
+        finish[idx] = cum + np.maximum.accumulate(rk - (cum - sk))
+    out = np.empty_like(finish)
+    out[order] = finish
+    return out
+
+
+def learned_service_minutes(ready, placed):
+    """
+    ai_engine._service_minutes() as of each placement: database.py's EWMA of
+    gaps between consecutive Ready events (gaps over SERVICE_GAP_CAP_MIN are
+    skipped), replayed over the simulated completions, with the flat default
+    until LEARNED_MIN_SAMPLES gaps are in.
+    """
+    done = np.sort(ready)
+    gaps = np.diff(done, prepend=np.nan)
+    means, counts = np.empty(done.size), np.empty(done.size, dtype=np.int64)
+    n, mean = 0, 0.0
+    for i, gap in enumerate(gaps.tolist()):
+        if 0 <= gap <= db.SERVICE_GAP_CAP_MIN:
+            n += 1
+            mean += db.EWMA_ALPHA * (gap - mean)
+        means[i], counts[i] = mean, n
+    last = np.searchsorted(done, placed, side="right") - 1
+    seen = np.where(last >= 0, counts[np.maximum(last, 0)], 0)
+    return np.where(seen >= ai_engine.LEARNED_MIN_SAMPLES, means[np.maximum(last, 0)],
+                    ai_engine.DEFAULT_SERVICE_MINUTES)
+
+
+def forecast_load(lam, start):
+    """Orders expected in the FORECAST_WINDOW_MIN after each `start` (absolute minutes) at arrival rate `lam`."""
+    cum = np.concatenate([[0.0], np.cumsum(np.tile(lam, 2))])
+    grid = np.arange(cum.size)
+    minute = start % MINUTES_PER_DAY
+    return np.interp(minute + ai_engine.FORECAST_WINDOW_MIN, grid, cum) - np.interp(minute, grid, cum)
+
+
+def fit_slots(placed, pickup, per_order, preorder):
+    """
+    Pickup times after ai_engine's slot fit: pre-orders, in placement order,
+    take the earliest scheduler.SLOT_MINUTES window at or after their pickup
+    with room left at slot_capacity(per_order). Other orders are unchanged.
+    """
+    fitted = pickup.copy()
+    used = {}
+    for i in np.flatnonzero(preorder)[np.argsort(placed[preorder], kind="stable")]:
+        capacity = scheduler.slot_capacity(per_order[i])
+        slot = int(pickup[i] // scheduler.SLOT_MINUTES)
+        while used.get(slot, 0) >= capacity:
+            slot += 1
+        used[slot] = used.get(slot, 0) + 1
+        fitted[i] = max(pickup[i], slot * scheduler.SLOT_MINUTES)
+    return fitted
+
+
+def predict_minutes(prep, active, per_order=ai_engine.DEFAULT_SERVICE_MINUTES, forecast_load=0.0):
+    """Vectorized ai_engine._predict()['minutes'] for arrays of prep times, queue counts and forecast load."""
+    multiplier = np.where(active + forecast_load > ai_engine.RUSH_THRESHOLD, ai_engine.RUSH_MULTIPLIER, 1.0)
+    queue_delay = (active * per_order * multiplier).astype(np.int64)
+    return prep + queue_delay + ai_engine.BUFFER_MINUTES
+
+
+def simulate_vendor(rng, preps, days, params, scale=1.0):
+    """Simulate one vendor; returns dict of per-order arrays."""
+    lam = arrival_rate(params, scale)
+    placed = generate_arrivals(rng, days, lam)
+    n = placed.size
+    menu_prep = preps[rng.integers(0, preps.size, n)]
+    sigma = np.sqrt(np.log1p(params["service_cv"] ** 2))
+    service = menu_prep * rng.lognormal(-0.5 * sigma ** 2, sigma, n)
+
+    # Pre-orders target the next break that is still ahead of them
+    day_minute = placed % MINUTES_PER_DAY
+    break_minutes = np.array(sorted(BREAKS.values()), dtype=float)
+    nxt = np.searchsorted(break_minutes, day_minute)
+    has_next = nxt < break_minutes.size
+    preorder = has_next & (rng.random(n) < params["preorder_share"])
+    target = np.where(preorder, placed - day_minute + break_minutes[np.minimum(nxt, break_minutes.size - 1)], np.nan)
+
+    # The KDS starts an order START_BUFFER_MIN before prep time alone would require
+    def start_at(pickup):
+        return np.where(preorder, np.maximum(placed, pickup - menu_prep - db.START_BUFFER_MIN), placed)
+
+    servers = int(max(1, round(params["servers"] * scale)))
+    collect_delay = rng.exponential(params["collect_delay"], n)
+    first = kitchen_finish_times(start_at(target), service, servers)
+    collected = np.maximum(first, np.where(preorder, target, first)) + collect_delay
+
+    # Queue the engine would have seen: placed before this order and not yet collected
+    active = np.searchsorted(np.sort(placed), placed, side="left") - np.searchsorted(np.sort(collected), placed, side="right")
+    per_order = learned_service_minutes(first, placed)
+    load = forecast_load(lam, np.where(preorder, np.maximum(placed, target - ai_engine.FORECAST_WINDOW_MIN), placed))
+    minutes = predict_minutes(menu_prep, active, per_order, load)
+    # Pre-orders get the break itself unless the kitchen can't finish by then, then the first slot with room
+    predicted = fit_slots(placed, np.where(preorder, np.maximum(target, placed + minutes), placed + minutes),
+                          per_order, preorder)
+    ready = kitchen_finish_times(start_at(predicted), service, servers)
+    return {
+        "placed": placed,
+        "hour": (day_minute // 60).astype(np.int64),
+        "preorder": preorder,
+        "active": active,
+        "per_order": per_order,
+        "predicted": predicted,
+        "ready": ready,
+        "error": ready - predicted,   # minutes late (+) or early (-)
+    }
+
+
+def _percentiles(err):
+    if err.size == 0:
+        return None
+    p50, p90, p95, p99 = np.percentile(err, [50, 90, 95, 99])
+    return {
+        "orders": int(err.size),
+        "mean_error": float(err.mean()),
+        "p50": float(p50), "p90": float(p90), "p95": float(p95), "p99": float(p99),
+        "late_share": float((err > 0).mean()),
+    }
+
+
+def run(days=100, scale=1.0, seed=42, db_file=None, **overrides):
+    params = {**DEFAULTS, **overrides}
+    rng = np.random.default_rng(seed)
+    catalog = load_catalog(db_file)
+    start = time.perf_counter()
+    report = {"params": {**params, "days": days, "scale": scale, "seed": seed}, "engine": ENGINE, "vendors": {}}
+    total = 0
+    for vendor_id, (name, preps) in catalog.items():
+        sim = simulate_vendor(rng, preps, days, params, scale)
+        total += sim["error"].size
+        by_hour = {}
+        for h in np.unique(sim["hour"]):
+            by_hour[f"{int(h):02d}:00"] = _percentiles(sim["error"][sim["hour"] == h])
+        report["vendors"][name] = {
+            "service_minutes": float(np.median(sim["per_order"])),
+            "overall": _percentiles(sim["error"]),
+            "immediate": _percentiles(sim["error"][~sim["preorder"]]),
+            "preorder": _percentiles(sim["error"][sim["preorder"]]),
+            "by_hour": by_hour,
+        }
+    report["orders"] = total
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+def print_report(report):
+    print(f"Simulated {report['orders']:,} orders in {report['seconds']:.2f}s "
+          f"(error = actual ready - predicted pickup, minutes)")
+    print(f"Engine: {', '.join(report['engine']['modelled'])}\n"
+          f"Not modelled: {', '.join(report['engine']['left_out'])}")
+    header = f"{'':<16}{'orders':>10}{'mean':>8}{'p50':>8}{'p90':>8}{'p95':>8}{'p99':>8}{'late%':>8}"
+    for name, res in report["vendors"].items():
+        print(f"\n== {name} == (median learned service {res['service_minutes']:.2f} min/order)\n{header}")
+        rows = [("overall", res["overall"]), ("immediate", res["immediate"]), ("pre-order", res["preorder"])]
+        rows += list(res["by_hour"].items())
+        for label, p in rows:
+            if p:
+                print(f"{label:<16}{p['orders']:>10,}{p['mean_error']:>8.1f}{p['p50']:>8.1f}{p['p90']:>8.1f}"
+                      f"{p['p95']:>8.1f}{p['p99']:>8.1f}{p['late_share'] * 100:>7.0f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest ai_engine pickup predictions against a simulated canteen.")
+    parser.add_argument("--days", type=int, default=100, help="simulated trading days (a semester is ~100)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply arrival rates and cooks per vendor")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=None, help="catalog database to read menus from (default: fresh seed)")
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    parser.add_argument("--json", metavar="PATH", help="also write the full report as JSON")
+    args = vars(parser.parse_args())
+    json_path = args.pop("json")
+    report = run(days=args.pop("days"), scale=args.pop("scale"), seed=args.pop("seed"), db_file=args.pop("db"), **args)
+    print_report(report)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()